@@ -0,0 +1,142 @@
+"""
+Reports stored bytes per event and decode latency of a synthetic shopping-cart
+dataset, uncompressed and compressed with a zstandard dictionary trained on
+another part of the dataset, as `EventStore.compress_events` stores them.
+No database is needed.
+
+Usage (from the repository root):
+
+    python -m appending_events_db.benchmarks.bench_compression
+"""
+
+import random
+import time
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+from uuid import uuid4 as uuid
+
+import zstandard
+
+from appending_events_db.src.appending_events_db import (
+    PricedProductItem,
+    ProductItemAddedToShoppingCart,
+    ProductItemRemovedFromShoppingCart,
+    ShoppingCartConfirmed,
+    ShoppingCartEvent,
+    ShoppingCartOpened,
+    event_codec,
+)
+from appending_events_db.src.appending_events_db.model import (
+    PayloadDictionaries,
+    PayloadFormat,
+    encode_payload,
+)
+
+CARTS = 2_000
+TRAINING_CARTS = 500
+ROUNDS = 5
+DICTIONARY_SIZE = 16 * 1024
+
+type StoredRow = tuple[str, str, str | bytes, int | None]
+
+catalogue = [
+    (str(uuid()), Decimal(random.randint(100, 20_000)) / 100) for _ in range(200)
+]
+clients = [str(uuid()) for _ in range(300)]
+
+
+def make_cart() -> list[ShoppingCartEvent]:
+    shopping_cart_id = str(uuid())
+    opened_at = datetime.now(UTC) - timedelta(days=random.randint(0, 90))
+    product_items = [
+        PricedProductItem(product_id=product_id, quantity=1, unit_price=unit_price)
+        for product_id, unit_price in random.sample(catalogue, random.randint(1, 8))
+    ]
+    events: list[ShoppingCartEvent] = [
+        ShoppingCartOpened(
+            data=ShoppingCartOpened.Data(
+                shopping_cart_id=shopping_cart_id,
+                client_id=random.choice(clients),
+                opened_at=opened_at,
+            )
+        ),
+        *[
+            ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id, product_item=product_item
+                )
+            )
+            for product_item in product_items
+        ],
+        ProductItemRemovedFromShoppingCart(
+            data=ProductItemRemovedFromShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id, product_item=product_items[0]
+            )
+        ),
+        ShoppingCartConfirmed(
+            data=ShoppingCartConfirmed.Data(
+                shopping_cart_id=shopping_cart_id,
+                confirmed_at=opened_at + timedelta(minutes=random.randint(1, 60)),
+            )
+        ),
+    ]
+    return events
+
+
+def as_bytes(payload: str | bytes) -> bytes:
+    return payload.encode() if isinstance(payload, str) else payload
+
+
+def main() -> None:
+    carts = [make_cart() for _ in range(TRAINING_CARTS + CARTS)]
+    training = [event for cart in carts[:TRAINING_CARTS] for event in cart]
+    events = [event for cart in carts[TRAINING_CARTS:] for event in cart]
+
+    payload_formats: list[PayloadFormat] = list(PayloadFormat)
+    dictionaries = PayloadDictionaries()
+    for dictionary_id, payload_format in enumerate(payload_formats, start=1):
+        samples: list[bytes | bytearray | memoryview[int]] = [
+            as_bytes(encode_payload(event.data, payload_format)) for event in training
+        ]
+        dictionary = zstandard.train_dictionary(DICTIONARY_SIZE, samples)
+        dictionaries.add(dictionary_id, dictionary.as_bytes())
+
+    print(f"{len(events)} events of {CARTS} carts\n")
+    print(f"{'payload':>24} {'bytes/event':>12} {'decode us/event':>16}")
+    for dictionary_id, payload_format in enumerate(payload_formats, start=1):
+        payloads = [encode_payload(event.data, payload_format) for event in events]
+        variants: list[tuple[str, list[StoredRow]]] = [
+            (
+                f"{payload_format}",
+                [
+                    (event.type, payload_format.value, payload, None)
+                    for event, payload in zip(events, payloads)
+                ],
+            ),
+            (
+                f"{payload_format} + zstd dict",
+                [
+                    (
+                        event.type,
+                        payload_format.value,
+                        dictionaries.compress(dictionary_id, as_bytes(payload)),
+                        dictionary_id,
+                    )
+                    for event, payload in zip(events, payloads)
+                ],
+            ),
+        ]
+        for name, rows in variants:
+            assert event_codec.decode(rows, dictionaries) == events
+            size = sum(len(as_bytes(payload)) for _, _, payload, _ in rows)
+            timings = []
+            for _ in range(ROUNDS):
+                started = time.perf_counter()
+                event_codec.decode(rows, dictionaries)
+                timings.append(time.perf_counter() - started)
+            latency = min(timings) / len(events) * 1_000_000
+            print(f"{name:>24} {size / len(events):>12.1f} {latency:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
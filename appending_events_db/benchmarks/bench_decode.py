@@ -0,0 +1,115 @@
+"""
+Measures decode throughput of stored events, without a database: the payload
+validation followed by the event construction the decoder used to do, against
+the single event validation per row of `EventCodec.decode`, for JSON and
+MessagePack payloads, and the payload size of both formats.
+
+Usage (from the repository root):
+
+    python -m appending_events_db.benchmarks.bench_decode
+"""
+
+import time
+from datetime import UTC, datetime
+from decimal import Decimal
+from typing import Callable
+from uuid import uuid4 as uuid
+
+from pydantic import BaseModel
+
+from appending_events_db.src.appending_events_db import (
+    PricedProductItem,
+    ProductItemAddedToShoppingCart,
+    ShoppingCartEvent,
+    ShoppingCartOpened,
+    event_codec,
+)
+from appending_events_db.src.appending_events_db.model import (
+    Event,
+    PayloadFormat,
+    encode_payload,
+)
+
+EVENTS = 20_000
+ROUNDS = 5
+
+
+def make_events() -> list[ShoppingCartEvent]:
+    shopping_cart_id = str(uuid())
+    events: list[ShoppingCartEvent] = [
+        ShoppingCartOpened(
+            data=ShoppingCartOpened.Data(
+                shopping_cart_id=shopping_cart_id,
+                client_id=str(uuid()),
+                opened_at=datetime.now(UTC),
+            )
+        ),
+        *[
+            ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    product_item=PricedProductItem(
+                        product_id=str(uuid()), quantity=1, unit_price=Decimal("9.99")
+                    ),
+                )
+            )
+            for _ in range(EVENTS - 1)
+        ],
+    ]
+    return events
+
+
+type StoredRow = tuple[str, str, str | bytes, int | None]
+
+
+def make_rows(
+    events: list[ShoppingCartEvent], payload_format: PayloadFormat
+) -> list[StoredRow]:
+    return [
+        (event.type, payload_format, encode_payload(event.data, payload_format), None)
+        for event in events
+    ]
+
+
+def two_step_decode(rows: list[StoredRow]) -> list[Event]:
+    """The previous decoder: validate the payload, then wrap it in its event."""
+    events = []
+    for event_type, _, event_data, _ in rows:
+        event_class = event_codec.event_types[event_type]
+        data_class: type[BaseModel] = getattr(event_class, "Data")
+        events.append(event_class(data=data_class.model_validate_json(event_data)))
+    return events
+
+
+def events_per_second(decode: Callable[[], object]) -> float:
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        decode()
+        timings.append(time.perf_counter() - started)
+    return EVENTS / min(timings)
+
+
+def main() -> None:
+    events = make_events()
+    json_rows = make_rows(events, PayloadFormat.Json)
+    msgpack_rows = make_rows(events, PayloadFormat.MessagePack)
+    assert event_codec.decode(json_rows) == event_codec.decode(msgpack_rows) == events
+
+    print(f"{'decoder':>16} {'events/s':>12} {'bytes/event':>12}")
+    decoders: list[
+        tuple[str, Callable[[list[StoredRow]], list[Event]], list[StoredRow]]
+    ]
+    decoders = [
+        ("two-step json", two_step_decode, json_rows),
+        ("codec json", event_codec.decode, json_rows),
+        ("codec msgpack", event_codec.decode, msgpack_rows),
+    ]
+    for name, decode, rows in decoders:
+        size = sum(len(payload) for _, _, payload, _ in rows) / EVENTS
+        throughput = events_per_second(lambda: decode(rows))
+        print(f"{name:>16} {throughput:>12.0f} {size:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,16 @@ from pydantic import BaseModel
 from datetime import datetime
 from enum import StrEnum
 
-from .event_store import EventStore, EventStream
-from .model import Event
-from typing import Callable
+from .event_store import (
+    AppendResult,
+    AsyncEventStore,
+    EventRow,
+    EventStore,
+    EventStream,
+)
+from .model import Event, EventCodec, PayloadDictionaries
+from itertools import batched
+from typing import Iterable, Iterator
 
 
 class ShoppingCartStatus(StrEnum):
@@ -104,31 +111,73 @@ class ShoppingCart(BaseModel):
 
 def append_to_stream(
     event_store: EventStore, stream_name: str, events: list[ShoppingCartEvent]
-) -> None:
-    event_store.append_events(stream_name, events)
+) -> AppendResult:
+    return event_store.append_events(stream_name, events)
 
 
 def read_stream(event_store: EventStore, stream_name: str) -> list[ShoppingCartEvent]:
-    events = event_store.read_stream(stream_name)
-    event_handlers: dict[str, Callable[[EventStream], ShoppingCartEvent]] = {
-        ShoppingCartOpened.type: lambda e: ShoppingCartOpened(
-            data=ShoppingCartOpened.Data.model_validate_json(str(e.event_data))
-        ),
-        ProductItemAddedToShoppingCart.type: lambda e: ProductItemAddedToShoppingCart(
-            data=ProductItemAddedToShoppingCart.Data.model_validate_json(
-                str(e.event_data)
-            )
-        ),
-        ProductItemRemovedFromShoppingCart.type: lambda e: ProductItemRemovedFromShoppingCart(
-            data=ProductItemRemovedFromShoppingCart.Data.model_validate_json(
-                str(e.event_data)
-            )
-        ),
-        ShoppingCartConfirmed.type: lambda e: ShoppingCartConfirmed(
-            data=ShoppingCartConfirmed.Data.model_validate_json(str(e.event_data))
-        ),
-        ShoppingCartCanceled.type: lambda e: ShoppingCartCanceled(
-            data=ShoppingCartCanceled.Data.model_validate_json(str(e.event_data))
-        ),
-    }
-    return [event_handlers[str(event.event_type)](event) for event in events]
+    return list(
+        decode_events(
+            event_store.read_stream_rows(stream_name), event_store.dictionaries
+        )
+    )
+
+
+async def append_to_stream_async(
+    event_store: AsyncEventStore, stream_name: str, events: list[ShoppingCartEvent]
+) -> AppendResult:
+    return await event_store.append_events(stream_name, events)
+
+
+async def read_stream_async(
+    event_store: AsyncEventStore, stream_name: str
+) -> list[ShoppingCartEvent]:
+    return list(
+        decode_events(
+            await event_store.read_stream(stream_name), event_store.dictionaries
+        )
+    )
+
+
+def iter_stream(
+    event_store: EventStore, stream_name: str
+) -> Iterator[ShoppingCartEvent]:
+    """
+    Lazily decodes the events of the stream while they are fetched.
+    """
+    return decode_events(event_store.iter_stream(stream_name), event_store.dictionaries)
+
+
+event_codec = EventCodec(
+    ShoppingCartOpened,
+    ProductItemAddedToShoppingCart,
+    ProductItemRemovedFromShoppingCart,
+    ShoppingCartConfirmed,
+    ShoppingCartCanceled,
+)
+
+
+def decode_events(
+    events: Iterable[EventStream | EventRow],
+    dictionaries: PayloadDictionaries | None = None,
+    batch_size: int = 500,
+) -> Iterator[ShoppingCartEvent]:
+    """
+    Lazily decodes stored events with the event codec, `batch_size` at a time.
+    Compressed payloads are decompressed with `dictionaries`.
+    """
+    for batch in batched(events, batch_size):
+        yield from event_codec.decode(
+            (
+                (
+                    str(event.event_type),
+                    event.payload_format,
+                    event.event_payload
+                    if event.event_payload is not None
+                    else str(event.event_data),
+                    event.dictionary_id,
+                )
+                for event in batch
+            ),
+            dictionaries,
+        )
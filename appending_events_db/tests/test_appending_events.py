@@ -1,7 +1,18 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from uuid import uuid4 as uuid
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, UTC
+from typing import Any, ClassVar, Literal
 
+import pytest
+from pydantic import BaseModel
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
 
 from appending_events_db.src.appending_events_db import (
     ProductItemRemovedFromShoppingCart,
@@ -12,9 +23,27 @@ from appending_events_db.src.appending_events_db import (
     ShoppingCartOpened,
     ProductItemAddedToShoppingCart,
     append_to_stream,
+    append_to_stream_async,
     read_stream,
+    read_stream_async,
+)
+from appending_events_db.src.appending_events_db.event_store import (
+    AsyncEventStore,
+    EventPartitioning,
+    EventStore,
+    EventStream,
+    ExpectedVersionConflictError,
+    GroupCommitWriter,
+    LogPosition,
+    ReadDirection,
+    StreamState,
+    create_event_tables,
+)
+from appending_events_db.src.appending_events_db.model import (
+    Event,
+    EventCodec,
+    PayloadFormat,
 )
-from appending_events_db.src.appending_events_db.event_store import EventStore
 
 
 def test_should_append_events_to_db(event_store: EventStore) -> None:
@@ -61,3 +90,611 @@ def test_should_append_events_to_db(event_store: EventStore) -> None:
     append_to_stream(event_store, stream_name, events)
     events_from_db = read_stream(event_store, stream_name)
     assert events == events_from_db
+
+
+def test_should_append_large_batches_with_copy(db_session: Session) -> None:
+    """
+    Test that batches above the COPY threshold are stored and their ids returned.
+    """
+    shopping_cart_id = str(uuid())
+    events: list[ShoppingCartEvent] = [
+        ProductItemAddedToShoppingCart(
+            data=ProductItemAddedToShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id,
+                product_item=PricedProductItem(
+                    product_id=str(uuid()), quantity=quantity, unit_price=Decimal("1.5")
+                ),
+            )
+        )
+        for quantity in range(1, 11)
+    ]
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+
+    with Session(db_session.get_bind()) as session:
+        event_store = EventStore(session, copy_threshold=5)
+        result = append_to_stream(event_store, stream_name, events)
+
+        assert {event.id for event in event_store.read_stream(stream_name)} == set(
+            result.event_ids
+        )
+        assert read_stream(event_store, stream_name) == events
+
+
+def test_should_read_streams_with_mixed_payload_formats(db_session: Session) -> None:
+    """
+    Test that MessagePack and JSON payloads of one stream are read back exactly.
+    """
+    pytest.importorskip("msgpack")
+    shopping_cart_id = str(uuid())
+    events: list[ShoppingCartEvent] = [
+        ShoppingCartOpened(
+            data=ShoppingCartOpened.Data(
+                shopping_cart_id=shopping_cart_id,
+                client_id=str(uuid()),
+                opened_at=datetime.now(UTC),
+            )
+        ),
+        *[
+            ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    product_item=PricedProductItem(
+                        product_id=str(uuid()), quantity=1, unit_price=Decimal("0.10")
+                    ),
+                )
+            )
+            for _ in range(4)
+        ],
+    ]
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+
+    with Session(db_session.get_bind()) as session:
+        msgpack_store = EventStore(
+            session, copy_threshold=3, payload_format=PayloadFormat.MessagePack
+        )
+        append_to_stream(msgpack_store, stream_name, events[:1])
+        append_to_stream(EventStore(session), stream_name, events[1:2])
+        append_to_stream(msgpack_store, stream_name, events[2:])
+
+        assert [e.payload_format for e in msgpack_store.read_stream(stream_name)] == [
+            "msgpack",
+            "json",
+            "msgpack",
+            "msgpack",
+            "msgpack",
+        ]
+        assert read_stream(msgpack_store, stream_name) == events
+
+
+def test_should_read_events_compressed_with_trained_dictionary(
+    db_session: Session,
+) -> None:
+    """
+    Test that cold events compressed with a trained dictionary read back exactly.
+    """
+    pytest.importorskip("zstandard")
+    product_ids = [str(uuid()) for _ in range(5)]
+    streams: dict[str, list[ShoppingCartEvent]] = {}
+    for _ in range(100):
+        shopping_cart_id = str(uuid())
+        streams[f"shopping_cart_{shopping_cart_id}"] = [
+            ShoppingCartOpened(
+                data=ShoppingCartOpened.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    client_id=str(uuid()),
+                    opened_at=datetime.now(UTC),
+                )
+            ),
+            *[
+                ProductItemAddedToShoppingCart(
+                    data=ProductItemAddedToShoppingCart.Data(
+                        shopping_cart_id=shopping_cart_id,
+                        product_item=PricedProductItem(
+                            product_id=product_id, quantity=1, unit_price=Decimal("2")
+                        ),
+                    )
+                )
+                for product_id in product_ids
+            ],
+        ]
+
+    with Session(db_session.get_bind()) as session:
+        event_store = EventStore(session)
+        for stream_name, events in streams.items():
+            append_to_stream(event_store, stream_name, events)
+        dictionary_id = event_store.train_dictionary(
+            sample_size=600, dictionary_size=4096
+        )
+
+        assert event_store.compress_events(timedelta(0), dictionary_id) >= 600
+        assert event_store.compress_events(timedelta(0), dictionary_id) == 0
+
+    with Session(db_session.get_bind()) as session:
+        event_store = EventStore(session)
+        for stream_name, events in streams.items():
+            rows = event_store.read_stream_rows(stream_name)
+            assert {(row.event_data, row.dictionary_id) for row in rows} == {
+                (None, dictionary_id)
+            }
+            assert read_stream(event_store, stream_name) == events
+
+
+def test_should_read_stream_in_stream_position_order(db_session: Session) -> None:
+    """
+    Test that appends continue the stream positions and reads follow them.
+    """
+    shopping_cart_id = str(uuid())
+    events: list[ShoppingCartEvent] = [
+        ProductItemAddedToShoppingCart(
+            data=ProductItemAddedToShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id,
+                product_item=PricedProductItem(
+                    product_id=str(uuid()), quantity=quantity, unit_price=Decimal("3")
+                ),
+            )
+        )
+        for quantity in range(1, 7)
+    ]
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+    other_stream_name = f"shopping_cart_{uuid()}"
+
+    with Session(db_session.get_bind()) as session:
+        event_store = EventStore(session)
+        append_to_stream(event_store, other_stream_name, events[:1])
+        first = append_to_stream(event_store, stream_name, events[:4])
+        second = append_to_stream(event_store, stream_name, events[4:])
+
+        # An object of the caller's session, that reads must leave attached
+        with session.begin():
+            other = session.scalars(
+                select(EventStream).where(EventStream.stream_name == other_stream_name)
+            ).one()
+        stream = event_store.read_stream(stream_name)
+        assert first.next_expected_stream_version == 4
+        assert second.next_expected_stream_version == 6
+        assert [event.stream_position for event in stream] == [1, 2, 3, 4, 5, 6]
+        assert read_stream(event_store, stream_name) == events
+        assert len(event_store.read_all(LogPosition.of(stream[0]))) == 5
+        assert other in session
+
+
+def test_should_read_windows_of_stream_in_both_directions(
+    event_store: EventStore,
+) -> None:
+    """
+    Test that stream reads can start at a version, stop after a count and go back.
+    """
+    shopping_cart_id = str(uuid())
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+    append_to_stream(
+        event_store,
+        stream_name,
+        [
+            ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    product_item=PricedProductItem(
+                        product_id=str(uuid()), quantity=1, unit_price=Decimal("3")
+                    ),
+                )
+            )
+            for _ in range(10)
+        ],
+    )
+
+    def positions(**window: Any) -> list[int]:
+        return [
+            event.stream_position
+            for event in event_store.read_stream(stream_name, **window)
+        ]
+
+    assert positions(from_version=7) == [8, 9, 10]
+    assert positions(from_version=2, max_count=3) == [3, 4, 5]
+    assert positions(max_count=3, direction=ReadDirection.Backward) == [10, 9, 8]
+    assert positions(from_version=5, max_count=2, direction=ReadDirection.Backward) == [
+        5,
+        4,
+    ]
+    assert len(event_store.read_stream_rows(stream_name, from_version=8)) == 2
+
+
+def test_should_page_through_all_streams_in_log_order(db_session: Session) -> None:
+    """
+    Test that read_all returns events of every stream in log position pages.
+    """
+    streams: dict[str, list[ShoppingCartEvent]] = {}
+    for _ in range(2):
+        shopping_cart_id = str(uuid())
+        streams[f"shopping_cart_{shopping_cart_id}"] = [
+            ShoppingCartOpened(
+                data=ShoppingCartOpened.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    client_id=str(uuid()),
+                    opened_at=datetime.now(UTC),
+                )
+            ),
+            ShoppingCartCanceled(
+                data=ShoppingCartCanceled.Data(
+                    shopping_cart_id=shopping_cart_id, canceled_at=datetime.now(UTC)
+                )
+            ),
+        ]
+
+    with Session(db_session.get_bind()) as session:
+        event_store = EventStore(session)
+        log_positions = [
+            log_position
+            for stream_name, events in streams.items()
+            for log_position in append_to_stream(
+                event_store, stream_name, events
+            ).log_positions
+        ]
+
+        pages = []
+        first = event_store.read_stream(next(iter(streams)), max_count=1)[0]
+        after = LogPosition(first.transaction_id, first.log_position - 1)
+        while page := event_store.read_all(after, max_count=3):
+            pages.append([event.log_position for event in page])
+            after = LogPosition.of(page[-1])
+
+        assert pages == [log_positions[:3], log_positions[3:]]
+
+
+def test_should_not_skip_positions_committed_out_of_order(
+    db_session: Session,
+) -> None:
+    """
+    Test that a consumer paging read_all gets an event whose transaction took a
+    lower log position but committed after the one it checkpointed on.
+    """
+    if db_session.get_bind().dialect.name != "postgresql":
+        pytest.skip("SQLite writers are serialized")
+    event_store = EventStore(db_session.get_bind().engine)
+
+    def confirmed() -> tuple[str, list[Event]]:
+        shopping_cart_id = str(uuid())
+        return f"shopping_cart_{shopping_cart_id}", [
+            ShoppingCartConfirmed(
+                data=ShoppingCartConfirmed.Data(
+                    shopping_cart_id=shopping_cart_id, confirmed_at=datetime.now(UTC)
+                )
+            )
+        ]
+
+    first_stream, first_events = confirmed()
+    second_stream, second_events = confirmed()
+    engine = db_session.get_bind().engine
+    with Session(engine) as first, Session(engine) as second:
+        # The first transaction gets the lower id claiming its stream head...
+        first.begin()
+        first_version = event_store._claim_positions(
+            first, first_stream, 1, StreamState.NoStream
+        )
+        transaction_id = first.execute(
+            text("SELECT pg_current_xact_id()::text::bigint")
+        ).scalar_one()
+        # ...but the second one inserts first, taking the lower log position
+        second.begin()
+        second_version = event_store._claim_positions(
+            second, second_stream, 1, StreamState.NoStream
+        )
+        [second_position] = event_store._insert_rows(
+            second,
+            event_store._event_rows(second_stream, second_version, second_events),
+        )
+        [first_position] = event_store._insert_rows(
+            first, event_store._event_rows(first_stream, first_version, first_events)
+        )
+        first.commit()
+        assert second_position < first_position
+
+        page = event_store.read_all(LogPosition(transaction_id, 0))
+        assert [event.log_position for event in page] == [first_position]
+        second.commit()
+        page = event_store.read_all(LogPosition.of(page[-1]))
+        assert [event.log_position for event in page] == [second_position]
+
+
+def test_should_append_events_concurrently_from_event_loop(
+    db_session: Session,
+) -> None:
+    """
+    Test that many appends can be in flight on one event loop.
+    """
+    if db_session.get_bind().dialect.name != "postgresql":
+        pytest.skip("Uses the async driver of Postgres")
+    url = db_session.get_bind().engine.url.set(drivername="postgresql+psycopg")
+
+    async def append_carts() -> None:
+        engine = create_async_engine(url, pool_size=10)
+        event_store = AsyncEventStore(async_sessionmaker(engine))
+        shopping_cart_ids = [str(uuid()) for _ in range(50)]
+        try:
+            await asyncio.gather(
+                *(
+                    append_to_stream_async(
+                        event_store,
+                        f"shopping_cart_{shopping_cart_id}",
+                        [
+                            ShoppingCartOpened(
+                                data=ShoppingCartOpened.Data(
+                                    shopping_cart_id=shopping_cart_id,
+                                    client_id=str(uuid()),
+                                    opened_at=datetime.now(UTC),
+                                )
+                            )
+                        ],
+                    )
+                    for shopping_cart_id in shopping_cart_ids
+                )
+            )
+            for shopping_cart_id in shopping_cart_ids:
+                events = await read_stream_async(
+                    event_store, f"shopping_cart_{shopping_cart_id}"
+                )
+                assert [type(e) for e in events] == [ShoppingCartOpened]
+        finally:
+            await engine.dispose()
+
+    asyncio.run(append_carts())
+
+
+def test_should_share_pooled_store_between_threads(db_session: Session) -> None:
+    """
+    Test that worker threads can append through one store with a session per call.
+    """
+    event_store = EventStore.from_url(
+        db_session.get_bind().engine.url.render_as_string(hide_password=False),
+        pool_size=4,
+        max_overflow=2,
+    )
+    shopping_cart_id = str(uuid())
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+
+    def add_product_item(_: int) -> None:
+        append_to_stream(
+            event_store,
+            stream_name,
+            [
+                ProductItemAddedToShoppingCart(
+                    data=ProductItemAddedToShoppingCart.Data(
+                        shopping_cart_id=shopping_cart_id,
+                        product_item=PricedProductItem(
+                            product_id=str(uuid()), quantity=1, unit_price=Decimal("1")
+                        ),
+                    )
+                )
+            ],
+        )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(add_product_item, range(40)))
+
+    assert event_store.stream_version(stream_name) == 40
+    assert [e.stream_position for e in event_store.read_stream(stream_name)] == list(
+        range(1, 41)
+    )
+    metrics = event_store.pool_metrics()
+    assert metrics.size == 4
+    assert metrics.checked_out == 0
+
+    with pytest.raises(ValueError):
+        EventStore(sessionmaker()).pool_metrics()
+    with pytest.raises(ValueError):
+        EventStore(create_engine("sqlite://")).pool_metrics()
+
+
+def test_should_append_to_hash_partitioned_event_table(db_session: Session) -> None:
+    """
+    Test that a hash partitioned table is appended to and read like a single one.
+    """
+    if db_session.get_bind().dialect.name != "postgresql":
+        pytest.skip("Partitioned event tables need Postgres")
+    url = db_session.get_bind().engine.url
+    with db_session.get_bind().engine.connect() as connection:
+        connection.execute(text("CREATE SCHEMA IF NOT EXISTS partitioned"))
+        connection.commit()
+    engine = create_engine(url, connect_args={"options": "-c search_path=partitioned"})
+    create_event_tables(engine, EventPartitioning(partitions=4))
+    event_store = EventStore(engine, copy_threshold=5)
+    shopping_cart_ids = [str(uuid()) for _ in range(8)]
+
+    for shopping_cart_id in shopping_cart_ids:
+        append_to_stream(
+            event_store,
+            f"shopping_cart_{shopping_cart_id}",
+            [
+                ProductItemAddedToShoppingCart(
+                    data=ProductItemAddedToShoppingCart.Data(
+                        shopping_cart_id=shopping_cart_id,
+                        product_item=PricedProductItem(
+                            product_id=str(uuid()), quantity=1, unit_price=Decimal("1")
+                        ),
+                    )
+                )
+                for _ in range(6)
+            ],
+        )
+
+    for shopping_cart_id in shopping_cart_ids:
+        stream = event_store.read_stream_rows(f"shopping_cart_{shopping_cart_id}")
+        assert len(stream) == 6
+    with engine.connect() as connection:
+        partitions = connection.execute(
+            text("SELECT count(DISTINCT tableoid) FROM event_streams")
+        ).scalar_one()
+    assert partitions > 1
+    engine.dispose()
+
+
+def test_should_group_commit_appends_of_many_threads(db_session: Session) -> None:
+    """
+    Test that coalesced appends keep stream order and their version checks.
+    """
+    shopping_cart_ids = [str(uuid()) for _ in range(4)]
+
+    def add_product_item(number: int) -> None:
+        shopping_cart_id = shopping_cart_ids[number % len(shopping_cart_ids)]
+        writer.append_events(
+            f"shopping_cart_{shopping_cart_id}",
+            [
+                ProductItemAddedToShoppingCart(
+                    data=ProductItemAddedToShoppingCart.Data(
+                        shopping_cart_id=shopping_cart_id,
+                        product_item=PricedProductItem(
+                            product_id=str(uuid()), quantity=1, unit_price=Decimal("1")
+                        ),
+                    )
+                )
+            ],
+        )
+
+    event_store = EventStore(db_session.get_bind().engine)
+    with GroupCommitWriter(event_store, max_delay=0.01) as writer:
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(add_product_item, range(80)))
+
+        stream_name = f"shopping_cart_{shopping_cart_ids[0]}"
+        confirmed = ShoppingCartConfirmed(
+            data=ShoppingCartConfirmed.Data(
+                shopping_cart_id=shopping_cart_ids[0], confirmed_at=datetime.now(UTC)
+            )
+        )
+        conflicting = writer.submit(stream_name, [confirmed], StreamState.NoStream)
+        matching = writer.submit(stream_name, [confirmed], 20)
+
+        with pytest.raises(ExpectedVersionConflictError):
+            conflicting.result()
+        assert matching.result().next_expected_stream_version == 21
+
+    for shopping_cart_id in shopping_cart_ids[1:]:
+        stream = event_store.read_stream(f"shopping_cart_{shopping_cart_id}")
+        assert [event.stream_position for event in stream] == list(range(1, 21))
+    assert read_stream(event_store, stream_name)[-1] == confirmed
+
+
+def test_should_drop_cancelled_appends_of_group_commit_batch(
+    db_session: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Test that a cancelled append isn't written and doesn't stall its batch.
+    """
+    shopping_cart_id = str(uuid())
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+    confirmed = ShoppingCartConfirmed(
+        data=ShoppingCartConfirmed.Data(
+            shopping_cart_id=shopping_cart_id, confirmed_at=datetime.now(UTC)
+        )
+    )
+    flushing = threading.Event()
+    release = threading.Event()
+
+    event_store = EventStore(db_session.get_bind().engine)
+    with GroupCommitWriter(event_store) as writer:
+        flush = writer._flush
+
+        def held_flush(batch: Any) -> None:
+            flushing.set()
+            release.wait()
+            flush(batch)
+
+        monkeypatch.setattr(writer, "_flush", held_flush)
+        first = writer.submit(stream_name, [confirmed])
+        flushing.wait()
+        # Queued while the writer holds the first batch, so taken together
+        kept = writer.submit(stream_name, [confirmed])
+        cancelled = writer.submit(stream_name, [confirmed])
+        last = writer.submit(stream_name, [confirmed])
+        assert cancelled.cancel()
+        release.set()
+
+        assert first.result().next_expected_stream_version == 1
+        assert kept.result().next_expected_stream_version == 2
+        assert last.result().next_expected_stream_version == 3
+
+        def failing_flush(batch: Any) -> None:
+            raise RuntimeError("Flush failed")
+
+        monkeypatch.setattr(writer, "_flush", failing_flush)
+        with pytest.raises(RuntimeError):
+            writer.append_events(stream_name, [confirmed])
+
+        monkeypatch.setattr(writer, "_flush", flush)
+        assert (
+            writer.append_events(
+                stream_name, [confirmed], 3
+            ).next_expected_stream_version
+            == 4
+        )
+
+    assert len(event_store.read_stream(stream_name)) == 4
+
+
+def test_should_resolve_append_submitted_while_closing(
+    db_session: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Test that an append racing close is written, not queued behind its sentinel.
+    """
+    shopping_cart_id = str(uuid())
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+    confirmed = ShoppingCartConfirmed(
+        data=ShoppingCartConfirmed.Data(
+            shopping_cart_id=shopping_cart_id, confirmed_at=datetime.now(UTC)
+        )
+    )
+    sentinel_queued = threading.Event()
+
+    class RacingQueue(queue.SimpleQueue[Any]):
+        def put(self, item: Any, block: bool = True, timeout: Any = None) -> None:
+            if item is None:
+                sentinel_queued.set()
+            else:
+                # Close while the append has passed the closed check; give its
+                # sentinel the chance to overtake the append
+                closing.start()
+                sentinel_queued.wait(timeout=0.2)
+            super().put(item, block, timeout)
+
+    monkeypatch.setattr(queue, "SimpleQueue", RacingQueue)
+    writer = GroupCommitWriter(EventStore(db_session.get_bind().engine))
+    closing = threading.Thread(target=writer.close)
+    result = writer.submit(stream_name, [confirmed])
+    closing.join()
+
+    assert result.done()
+    assert result.result().next_expected_stream_version == 1
+
+
+def test_should_decode_registered_event_types() -> None:
+    """
+    Test that event types registered with the codec are decoded in order.
+    """
+
+    class ShoppingCartEmptied(Event):
+        type: ClassVar[Literal["ShoppingCartEmptied"]] = "ShoppingCartEmptied"
+
+        class Data(BaseModel):
+            shopping_cart_id: str
+
+        data: Data
+
+    codec = EventCodec(ShoppingCartOpened)
+    codec.register(ShoppingCartEmptied)
+    opened = ShoppingCartOpened(
+        data=ShoppingCartOpened.Data(
+            shopping_cart_id="cart", client_id="client", opened_at=datetime.now(UTC)
+        )
+    )
+    emptied = ShoppingCartEmptied(
+        data=ShoppingCartEmptied.Data(shopping_cart_id="cart")
+    )
+
+    assert codec.decode(
+        [
+            (event.type, PayloadFormat.Json, event.data.model_dump_json(), None)
+            for event in [opened, emptied]
+        ]
+    ) == [opened, emptied]
+    with pytest.raises(ValueError):
+        codec.decode([("ShoppingCartConfirmed", PayloadFormat.Json, "{}", None)])
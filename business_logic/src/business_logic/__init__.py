@@ -5,6 +5,7 @@ from pydantic import BaseModel
 from business_logic.src.business_logic.model import Command
 from .shopping_cart import (
     PricedProductItem,
+    ProductItems,
     ShoppingCart,
     ShoppingCartEvent,
     ShoppingCartStatus,
@@ -95,9 +96,9 @@ class ShoppingCartException(Exception):
 
 
 def assert_product_item_exists(
-    product_items: list[PricedProductItem], product_item: PricedProductItem
+    product_items: ProductItems, product_item: PricedProductItem
 ) -> None:
-    """Check if a product item exists in a list of items."""
+    """Check if the cart has a line for the product item, with a dict lookup."""
     if product_item not in product_items:
         raise ShoppingCartException(ShoppingCartErrors.ProductItemNotFound)
 
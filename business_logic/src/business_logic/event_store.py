@@ -1,17 +1,115 @@
-from typing import Generic, TypeVar
-from collections import defaultdict
+import threading
+from enum import StrEnum
+from typing import Generic, NamedTuple, Sequence, TypeVar
 
 T = TypeVar("T")
+S = TypeVar("S")
+
+
+class ReadDirection(StrEnum):
+    Forward = "forward"
+    Backward = "backward"
+
+
+def stream_window(
+    events: Sequence[S],
+    from_version: int | None,
+    max_count: int | None,
+    direction: ReadDirection,
+) -> list[S]:
+    """
+    Copies the window of a stream's events `read_stream` returns: forward, the
+    events after `from_version` oldest first; backward, the events up to
+    `from_version` or the head newest first. At most `max_count` of them.
+    """
+    if direction == ReadDirection.Forward:
+        start = from_version or 0
+        end = None if max_count is None else start + max_count
+        return _as_list(events[start:end])
+    end = len(events) if from_version is None else min(from_version, len(events))
+    start = 0 if max_count is None else max(end - max_count, 0)
+    window = _as_list(events[start:end])
+    window.reverse()
+    return window
+
+
+def _as_list(window: Sequence[S]) -> list[S]:
+    # A slice of a list is already a copy
+    return window if isinstance(window, list) else list(window)
+
+
+class _Stream(Generic[T]):
+    __slots__ = ("lock", "events")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.events: list[T] = []
+
+
+class LoggedEvent(NamedTuple, Generic[T]):
+    stream_name: str
+    event: T
 
 
 class EventStore(Generic[T]):
     def __init__(self) -> None:
-        self.streams: dict[str, list[T]] = defaultdict(list)
+        """
+        In-memory event store safe to share between threads. Appends to one stream
+        are serialized by its own lock, so writers of different streams only meet
+        on the short append to the global log.
+        """
+        self._streams: dict[str, _Stream[T]] = {}
+        self._streams_lock = threading.Lock()
+        self._log: list[LoggedEvent[T]] = []
+        self._log_lock = threading.Lock()
+
+    def read_stream(
+        self,
+        stream_name: str,
+        from_version: int | None = None,
+        max_count: int | None = None,
+        direction: ReadDirection = ReadDirection.Forward,
+    ) -> list[T]:
+        """
+        Returns a copy of a window of the stream, see `stream_window`,
+        an empty list for an unknown stream.
+        """
+        stream = self._streams.get(stream_name)
+        if stream is None:
+            return []
+        with stream.lock:
+            return stream_window(stream.events, from_version, max_count, direction)
+
+    def stream_version(self, stream_name: str) -> int:
+        stream = self._streams.get(stream_name)
+        return len(stream.events) if stream is not None else 0
+
+    def append_events(self, stream_name: str, events: list[T]) -> int:
+        """
+        Appends events at the end of the stream and returns its new version.
+        """
+        stream = self._stream(stream_name)
+        with stream.lock:
+            stream.events.extend(events)
+            # Taken under the stream lock, so the log keeps the stream order
+            with self._log_lock:
+                self._log.extend(LoggedEvent(stream_name, event) for event in events)
+            return len(stream.events)
 
-    def read_stream(self, stream_name: str) -> list[T]:
-        return self.streams[stream_name]
+    def read_all(
+        self, from_position: int = 0, max_count: int | None = None
+    ) -> list[LoggedEvent[T]]:
+        """
+        Returns up to `max_count` events of all streams after `from_position`,
+        in append order.
+        """
+        with self._log_lock:
+            end = None if max_count is None else from_position + max_count
+            return self._log[from_position:end]
 
-    def append_events(self, stream_name: str, events: list[T]) -> None:
-        if stream_name not in self.streams:
-            self.streams[stream_name] = []
-        self.streams[stream_name].extend(events)
+    def _stream(self, stream_name: str) -> _Stream[T]:
+        stream = self._streams.get(stream_name)
+        if stream is None:
+            with self._streams_lock:
+                stream = self._streams.setdefault(stream_name, _Stream())
+        return stream
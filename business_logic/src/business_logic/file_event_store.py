@@ -0,0 +1,351 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from enum import StrEnum
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+
+from pydantic import BaseModel
+
+from .event_store import ReadDirection, stream_window
+from .shopping_cart import Event
+
+
+class FsyncPolicy(StrEnum):
+    # Every appended batch is on disk when append_events returns
+    Batch = "batch"
+    # Appends are flushed every `fsync_interval` seconds by a background
+    # thread, a crash loses what was appended since the last flush
+    Interval = "interval"
+
+
+class IndexRecovery(StrEnum):
+    # Rebuilds the stream index by scanning every segment
+    Scan = "scan"
+    # Loads the index checkpoint written on rollover and close, then scans only
+    # the records appended after it
+    Checkpoint = "checkpoint"
+
+
+# Body length and CRC32 of the body
+_RECORD_HEADER = struct.Struct("<II")
+# Stream name and event type lengths, followed by both and the JSON payload
+_BODY_HEADER = struct.Struct("<HH")
+# Index entries pack the segment number above the offset in the segment
+_OFFSET_BITS = 40
+_OFFSET_MASK = (1 << _OFFSET_BITS) - 1
+_CHECKPOINT = "index.json"
+
+
+class _Checkpoint(BaseModel):
+    # Records before this segment and offset are in the stream index
+    segment: int
+    offset: int
+    streams: dict[str, list[int]]
+
+
+class _Record(NamedTuple):
+    offset: int
+    end: int
+    stream_name: str
+    event_type: str
+    payload_start: int
+
+
+class FileEventStore[T: Event]:
+    def __init__(
+        self,
+        directory: str | Path,
+        event_types: Iterable[type[T]],
+        segment_size: int = 64 * 1024 * 1024,
+        fsync_policy: FsyncPolicy = FsyncPolicy.Batch,
+        fsync_interval: float = 1.0,
+        index_recovery: IndexRecovery = IndexRecovery.Checkpoint,
+    ):
+        """
+        Append-only event log in `directory`, split into segment files of
+        `segment_size` bytes that are memory-mapped for reading and writing.
+        Each record holds the stream name, event type and JSON payload of an
+        event behind its length and CRC32, so a torn write is detected and cut
+        off when the store is opened again.
+
+        Streams are indexed by the offsets of their records. Reads slice the
+        mapped segments and only copy the payload to decode it.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.event_types = {event_type.type: event_type for event_type in event_types}
+        self.segment_size = segment_size
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._segments: list[mmap.mmap] = []
+        self._streams: dict[str, array[int]] = {}
+        self._write_offset = 0
+        self._synced_offset = 0
+        self._synced_at = time.monotonic()
+        self._recover(index_recovery)
+        self._closing = threading.Event()
+        self._syncer: threading.Thread | None = None
+        if fsync_policy == FsyncPolicy.Interval:
+            self._syncer = threading.Thread(
+                target=self._sync_periodically,
+                name="file-event-store-sync",
+                daemon=True,
+            )
+            self._syncer.start()
+
+    def append_events(self, stream_name: str, events: list[T]) -> None:
+        records = [_encode_record(stream_name, event) for event in events]
+        if any(len(record) > self.segment_size for record in records):
+            raise ValueError(f"Event larger than the segment size {self.segment_size}")
+        with self._lock:
+            positions = self._streams.setdefault(stream_name, array("Q"))
+            for record in records:
+                if self._write_offset + len(record) > self.segment_size:
+                    self._roll()
+                end = self._write_offset + len(record)
+                self._segments[-1][self._write_offset : end] = record
+                positions.append(
+                    (len(self._segments) - 1) << _OFFSET_BITS | self._write_offset
+                )
+                self._write_offset = end
+            if (
+                self.fsync_policy == FsyncPolicy.Batch
+                or time.monotonic() - self._synced_at >= self.fsync_interval
+            ):
+                self._sync()
+
+    def read_stream(
+        self,
+        stream_name: str,
+        from_version: int | None = None,
+        max_count: int | None = None,
+        direction: ReadDirection = ReadDirection.Forward,
+    ) -> list[T]:
+        """
+        Decodes a window of the stream, see `stream_window`.
+        """
+        with self._lock:
+            # Copies the offsets only, records before them are never rewritten
+            positions = stream_window(
+                self._streams.get(stream_name, array("Q")),
+                from_version,
+                max_count,
+                direction,
+            )
+        return [
+            self._decode(
+                self._segments[position >> _OFFSET_BITS], position & _OFFSET_MASK
+            )
+            for position in positions
+        ]
+
+    def read_all(self) -> Iterator[tuple[str, T]]:
+        """
+        Yields the stream name and event of every record in append order,
+        reading the segments sequentially.
+        """
+        with self._lock:
+            segments = list(self._segments)
+            write_offset = self._write_offset
+        for number, segment in enumerate(segments):
+            end = write_offset if number == len(segments) - 1 else len(segment)
+            for record in _scan(segment, 0, end):
+                yield (
+                    record.stream_name,
+                    self._validate(
+                        record.event_type, segment[record.payload_start : record.end]
+                    ),
+                )
+
+    def close(self) -> None:
+        self._closing.set()
+        if self._syncer is not None:
+            self._syncer.join()
+        with self._lock:
+            if not self._segments:
+                return
+            self._sync()
+            self._write_checkpoint()
+            for segment in self._segments:
+                segment.close()
+            self._segments.clear()
+
+    def __enter__(self) -> "FileEventStore[T]":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def _decode(self, segment: mmap.mmap, offset: int) -> T:
+        length, _ = _RECORD_HEADER.unpack_from(segment, offset)
+        body = offset + _RECORD_HEADER.size
+        name_length, type_length = _BODY_HEADER.unpack_from(segment, body)
+        type_start = body + _BODY_HEADER.size + name_length
+        payload_start = type_start + type_length
+        return self._validate(
+            segment[type_start:payload_start].decode(),
+            segment[payload_start : body + length],
+        )
+
+    def _validate(self, event_type: str, payload: bytes) -> T:
+        event_class = self.event_types.get(event_type)
+        if event_class is None:
+            raise ValueError(f"Unknown event type: {event_type}")
+        return event_class.model_validate_json(payload)
+
+    def _recover(self, index_recovery: IndexRecovery) -> None:
+        paths = sorted(self.directory.glob("*.segment"))
+        if not paths:
+            self._segments.append(self._map(self._segment_path(0)))
+            _sync_directory(self.directory)
+            return
+        self._segments = [self._map(path) for path in paths]
+
+        start_segment, start_offset = 0, 0
+        if index_recovery == IndexRecovery.Checkpoint:
+            checkpoint = self._read_checkpoint()
+            if checkpoint is not None and checkpoint.segment < len(paths):
+                start_segment, start_offset = checkpoint.segment, checkpoint.offset
+                self._streams = {
+                    stream_name: array("Q", positions)
+                    for stream_name, positions in checkpoint.streams.items()
+                }
+
+        last = len(self._segments) - 1
+        for number in range(start_segment, last + 1):
+            segment = self._segments[number]
+            end = start_offset if number == start_segment else 0
+            for record in _scan(segment, end, len(segment)):
+                self._streams.setdefault(record.stream_name, array("Q")).append(
+                    number << _OFFSET_BITS | record.offset
+                )
+                end = record.end
+            if any(segment[end : end + _RECORD_HEADER.size]):
+                if number != last:
+                    raise ValueError(f"Corrupted record in {paths[number]} at {end}")
+                # Clear the torn record, so it can't be mistaken for a valid one
+                length, _ = _RECORD_HEADER.unpack_from(segment, end)
+                torn_end = min(end + _RECORD_HEADER.size + length, len(segment))
+                segment[end:torn_end] = bytes(torn_end - end)
+            self._write_offset = end
+        self._synced_offset = self._write_offset
+
+    def _roll(self) -> None:
+        self._sync()
+        self._segments.append(self._map(self._segment_path(len(self._segments))))
+        _sync_directory(self.directory)
+        self._write_offset = 0
+        self._synced_offset = 0
+        self._write_checkpoint()
+
+    def _sync(self) -> None:
+        # msync only the pages written since the last sync
+        start = self._synced_offset - self._synced_offset % mmap.PAGESIZE
+        if self._write_offset > start:
+            self._segments[-1].flush(start, self._write_offset - start)
+        self._synced_offset = self._write_offset
+        self._synced_at = time.monotonic()
+
+    def _sync_periodically(self) -> None:
+        # Syncs the tail of a store that stopped appending, appends only check
+        # the interval when they come
+        while not self._closing.wait(self.fsync_interval):
+            with self._lock:
+                if (
+                    self._segments
+                    and time.monotonic() - self._synced_at >= self.fsync_interval
+                ):
+                    self._sync()
+
+    def _map(self, path: Path) -> mmap.mmap:
+        # Segments are preallocated as sparse files, a zero header marks the end
+        with open(path, "a+b") as file:
+            if os.fstat(file.fileno()).st_size < self.segment_size:
+                file.truncate(self.segment_size)
+            return mmap.mmap(file.fileno(), 0)
+
+    def _segment_path(self, number: int) -> Path:
+        return self.directory / f"{number:08d}.segment"
+
+    def _read_checkpoint(self) -> _Checkpoint | None:
+        path = self.directory / _CHECKPOINT
+        if not path.exists():
+            return None
+        try:
+            return _Checkpoint.model_validate_json(path.read_bytes())
+        except ValueError:
+            return None
+
+    def _write_checkpoint(self) -> None:
+        """
+        Writes the stream index up to the synced records, replacing the previous
+        checkpoint atomically.
+        """
+        path = self.directory / _CHECKPOINT
+        temporary = path.with_suffix(".tmp")
+        checkpoint = _Checkpoint(
+            segment=len(self._segments) - 1,
+            offset=self._synced_offset,
+            streams={
+                stream_name: positions.tolist()
+                for stream_name, positions in self._streams.items()
+            },
+        )
+        with open(temporary, "w") as file:
+            file.write(checkpoint.model_dump_json())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+        _sync_directory(self.directory)
+
+
+def _encode_record(stream_name: str, event: Event) -> bytes:
+    name = stream_name.encode()
+    event_type = event.type.encode()
+    body = (
+        _BODY_HEADER.pack(len(name), len(event_type))
+        + name
+        + event_type
+        + event.model_dump_json().encode()
+    )
+    return _RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def _scan(segment: mmap.mmap, offset: int, end: int) -> Iterator[_Record]:
+    """
+    Yields the valid records from `offset`, up to `end` or the first empty or
+    torn record.
+    """
+    while offset + _RECORD_HEADER.size <= end:
+        length, checksum = _RECORD_HEADER.unpack_from(segment, offset)
+        body = offset + _RECORD_HEADER.size
+        if length == 0 or body + length > end:
+            return
+        if zlib.crc32(segment[body : body + length]) != checksum:
+            return
+        name_length, type_length = _BODY_HEADER.unpack_from(segment, body)
+        name_start = body + _BODY_HEADER.size
+        type_start = name_start + name_length
+        yield _Record(
+            offset,
+            body + length,
+            segment[name_start:type_start].decode(),
+            segment[type_start : type_start + type_length].decode(),
+            type_start + type_length,
+        )
+        offset = body + length
+
+
+def _sync_directory(directory: Path) -> None:
+    # Makes new segment and checkpoint file names durable
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
@@ -1,9 +1,9 @@
 from decimal import Decimal
-from typing import Literal, ClassVar
-from pydantic import BaseModel
+from typing import Any, Iterable, Iterator, Literal, ClassVar, Sequence, overload
+from pydantic import BaseModel, GetCoreSchemaHandler
+from pydantic_core import CoreSchema, core_schema
 from datetime import datetime
 from enum import StrEnum
-from .core import merge
 
 
 class Event(BaseModel):
@@ -29,6 +29,136 @@ class PricedProductItem(ProductItem):
             self.product_id == other.product_id and self.unit_price == other.unit_price
         )
 
+    def __hash__(self) -> int:
+        # Consistent with __eq__, equal Decimals such as 2.5 and 2.50 hash alike
+        return hash((self.product_id, self.unit_price))
+
+
+class ProductItems(Sequence[PricedProductItem]):
+    """
+    Product items of a cart in the order they were first added, keyed by product
+    id and unit price, so finding the line of an item takes a dict lookup
+    instead of a scan of the list. Validates from and dumps to a plain list,
+    and compares equal to a list of the same items.
+
+    `added` and `removed` return a new collection, leaving the state the
+    previous one belongs to untouched; they copy every line, so `evolve` stays
+    O(n) per event. A fold that owns the collection can use `add` and `remove`
+    to update it in place instead.
+    """
+
+    __slots__ = ("_items", "_values")
+
+    def __init__(self, product_items: Iterable[PricedProductItem] = ()):
+        self._items: dict[tuple[str, Decimal], PricedProductItem] = {}
+        # Items as a list for indexing, built on first access after a change
+        self._values: list[PricedProductItem] | None = None
+        for product_item in product_items:
+            self.add(product_item)
+
+    def added(self, product_item: PricedProductItem) -> "ProductItems":
+        """
+        Adds the quantity of the item to its line, or appends a new line.
+        """
+        product_items = self._copy()
+        product_items.add(product_item)
+        return product_items
+
+    def removed(self, product_item: PricedProductItem) -> "ProductItems":
+        """
+        Takes the quantity of the item off its line, if the cart has one.
+        """
+        if product_item not in self:
+            return self
+        product_items = self._copy()
+        product_items.remove(product_item)
+        return product_items
+
+    def add(self, product_item: PricedProductItem) -> None:
+        """
+        Like `added`, but updates this collection in place.
+        """
+        self._values = None
+        key = (product_item.product_id, product_item.unit_price)
+        existing = self._items.get(key)
+        self._items[key] = (
+            product_item
+            if existing is None
+            else existing.model_copy(
+                update={"quantity": existing.quantity + product_item.quantity}
+            )
+        )
+
+    def remove(self, product_item: PricedProductItem) -> None:
+        """
+        Like `removed`, but updates this collection in place.
+        """
+        self._values = None
+        key = (product_item.product_id, product_item.unit_price)
+        existing = self._items.get(key)
+        if existing is not None:
+            self._items[key] = existing.model_copy(
+                update={"quantity": existing.quantity - product_item.quantity}
+            )
+
+    def get(self, product_id: str, unit_price: Decimal) -> PricedProductItem | None:
+        return self._items.get((product_id, unit_price))
+
+    def __contains__(self, product_item: object) -> bool:
+        return (
+            isinstance(product_item, PricedProductItem)
+            and (product_item.product_id, product_item.unit_price) in self._items
+        )
+
+    def __iter__(self) -> Iterator[PricedProductItem]:
+        return iter(self._items.values())
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @overload
+    def __getitem__(self, index: int) -> PricedProductItem: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[PricedProductItem]: ...
+
+    def __getitem__(
+        self, index: int | slice
+    ) -> PricedProductItem | list[PricedProductItem]:
+        if self._values is None:
+            self._values = list(self._items.values())
+        return self._values[index]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, ProductItems):
+            return list(self) == list(other)
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ProductItems({list(self)!r})"
+
+    @classmethod
+    def __get_pydantic_core_schema__(
+        cls, source: Any, handler: GetCoreSchemaHandler
+    ) -> CoreSchema:
+        items_schema = handler.generate_schema(list[PricedProductItem])
+        return core_schema.union_schema(
+            [
+                core_schema.is_instance_schema(cls),
+                core_schema.no_info_after_validator_function(cls, items_schema),
+            ],
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                list, return_schema=items_schema
+            ),
+        )
+
+    def _copy(self) -> "ProductItems":
+        product_items = ProductItems()
+        product_items._items = self._items.copy()
+        return product_items
+
 
 class ShoppingCartOpened(Event):
     type: ClassVar[Literal["ShoppingCartOpened"]] = "ShoppingCartOpened"
@@ -108,7 +238,7 @@ class Empty(BaseModel):
 class Pending(BaseModel):
     id: str
     status: ClassVar[ShoppingCartStatus] = ShoppingCartStatus.Pending
-    product_items: list[PricedProductItem] = []
+    product_items: ProductItems = ProductItems()
     client_id: str
     opened_at: datetime
 
@@ -117,7 +247,7 @@ class Confirmed(BaseModel):
     id: str
     status: ClassVar[ShoppingCartStatus] = ShoppingCartStatus.Confirmed
     confirmed_at: datetime
-    product_items: list[PricedProductItem] = []
+    product_items: ProductItems = ProductItems()
     client_id: str
 
 
@@ -125,7 +255,7 @@ class Canceled(BaseModel):
     id: str
     status: ClassVar[ShoppingCartStatus] = ShoppingCartStatus.Canceled
     canceled_at: datetime
-    product_items: list[PricedProductItem] = []
+    product_items: ProductItems = ProductItems()
     client_id: str
 
 
@@ -139,7 +269,7 @@ def apply_shopping_cart_opened(
 ) -> ShoppingCart:
     return Pending(
         id=event.data.shopping_cart_id,
-        product_items=[],
+        product_items=ProductItems(),
         client_id=event.data.client_id,
         opened_at=event.data.opened_at,
     )
@@ -151,20 +281,9 @@ def apply_product_item_added(
     if not isinstance(state, Pending):
         return state
 
-    return Pending(
-        **state.model_dump(exclude={"product_items"}),
-        product_items=merge(
-            state.product_items,
-            event.data.product_item,
-            lambda p: p.product_id == event.data.product_item.product_id
-            and p.unit_price == event.data.product_item.unit_price,
-            lambda p, _: PricedProductItem(
-                product_id=p.product_id,
-                quantity=p.quantity + event.data.product_item.quantity,
-                unit_price=p.unit_price,
-            ),
-            on_not_found=lambda _: event.data.product_item,
-        ),
+    # Copies without validating again, the items are already validated
+    return state.model_copy(
+        update={"product_items": state.product_items.added(event.data.product_item)}
     )
 
 
@@ -174,20 +293,8 @@ def apply_product_item_removed(
     if not isinstance(state, Pending):
         return state
 
-    return Pending(
-        **state.model_dump(exclude={"product_items"}),
-        product_items=merge(
-            state.product_items,
-            event.data.product_item,
-            lambda p: p.product_id == event.data.product_item.product_id
-            and p.unit_price == event.data.product_item.unit_price,
-            lambda p, _: PricedProductItem(
-                product_id=p.product_id,
-                quantity=p.quantity - event.data.product_item.quantity,
-                unit_price=p.unit_price,
-            ),
-            on_not_found=lambda _: None,
-        ),
+    return state.model_copy(
+        update={"product_items": state.product_items.removed(event.data.product_item)}
     )
 
 
@@ -198,8 +305,10 @@ def apply_shopping_cart_confirmed(
         return state
 
     return Confirmed(
-        **state.model_dump(),
+        id=state.id,
         confirmed_at=event.data.confirmed_at,
+        product_items=state.product_items,
+        client_id=state.client_id,
     )
 
 
@@ -210,8 +319,10 @@ def apply_shopping_cart_canceled(
         return state
 
     return Canceled(
-        **state.model_dump(),
+        id=state.id,
         canceled_at=event.data.canceled_at,
+        product_items=state.product_items,
+        client_id=state.client_id,
     )
 
 
@@ -234,5 +345,13 @@ def evolve(event: ShoppingCartEvent, state: ShoppingCart) -> ShoppingCart:
 def get_shopping_cart_from_events(events: list[ShoppingCartEvent]) -> ShoppingCart:
     state: ShoppingCart = Empty()
     for event in events:
-        state = evolve(event, state)
+        # Every cart here was opened by this fold, so nothing else holds its
+        # lines and they can be updated in place instead of copied per event
+        match event, state:
+            case ProductItemAddedToShoppingCart(), Pending():
+                state.product_items.add(event.data.product_item)
+            case ProductItemRemovedFromShoppingCart(), Pending():
+                state.product_items.remove(event.data.product_item)
+            case _:
+                state = evolve(event, state)
     return state
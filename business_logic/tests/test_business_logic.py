@@ -1,4 +1,7 @@
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+from pathlib import Path
 from uuid import uuid4 as uuid
 from datetime import datetime, UTC
 import pytest
@@ -15,6 +18,12 @@ from business_logic.src.business_logic import (
 )
 from business_logic.src.business_logic.event_store import (
     EventStore,
+    ReadDirection,
+)
+from business_logic.src.business_logic.file_event_store import (
+    FileEventStore,
+    FsyncPolicy,
+    IndexRecovery,
 )
 
 from business_logic.src.business_logic.shopping_cart import (
@@ -24,6 +33,9 @@ from business_logic.src.business_logic.shopping_cart import (
     ProductItemAddedToShoppingCart,
     ProductItemRemovedFromShoppingCart,
     ShoppingCartConfirmed,
+    ShoppingCartCanceled,
+    Pending,
+    evolve,
     get_shopping_cart_from_events,
     empty_shopping_cart,
 )
@@ -159,3 +171,218 @@ def test_business_logic() -> None:
     events_from_db = event_store.read_stream(stream_name)
 
     assert events_from_db == expected_events
+
+
+def test_product_items_are_keyed_by_product_and_unit_price() -> None:
+    """
+    Test that cart lines merge by product and unit price, keeping their order.
+    """
+    shopping_cart_id = str(uuid())
+    product_ids = [str(uuid()) for _ in range(3)]
+
+    def item(product_id: str, quantity: int, unit_price: str) -> PricedProductItem:
+        return PricedProductItem(
+            product_id=product_id, quantity=quantity, unit_price=Decimal(unit_price)
+        )
+
+    opened = ShoppingCartOpened(
+        data=ShoppingCartOpened.Data(
+            shopping_cart_id=shopping_cart_id,
+            client_id=str(uuid()),
+            opened_at=datetime.now(UTC),
+        )
+    )
+    added = [
+        ProductItemAddedToShoppingCart(
+            data=ProductItemAddedToShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id, product_item=product_item
+            )
+        )
+        for product_item in [
+            item(product_ids[0], 1, "2.5"),
+            item(product_ids[1], 1, "10"),
+            item(product_ids[0], 2, "2.50"),
+            item(product_ids[0], 1, "3"),
+        ]
+    ]
+    state = get_shopping_cart_from_events([opened, *added])
+    assert isinstance(state, Pending)
+    assert [
+        (product_item.product_id, product_item.quantity, product_item.unit_price)
+        for product_item in state.product_items
+    ] == [
+        (product_ids[0], 3, Decimal("2.5")),
+        (product_ids[1], 1, Decimal("10")),
+        (product_ids[0], 1, Decimal("3")),
+    ]
+    assert item(product_ids[1], 5, "10.00") in state.product_items
+    assert item(product_ids[2], 1, "10") not in state.product_items
+
+    removed = evolve(
+        ProductItemRemovedFromShoppingCart(
+            data=ProductItemRemovedFromShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id,
+                product_item=item(product_ids[0], 2, "2.5"),
+            )
+        ),
+        state,
+    )
+    assert isinstance(removed, Pending)
+    assert removed.product_items[0].quantity == 1
+    assert state.product_items[0].quantity == 3
+    assert Pending.model_validate_json(removed.model_dump_json()) == removed
+
+
+def test_file_event_store_recovers_streams_from_segments(tmp_path: Path) -> None:
+    """
+    Test that streams spread over several segments are read back after reopening.
+    """
+    event_types: list[type[ShoppingCartEvent]] = [
+        ShoppingCartOpened,
+        ProductItemAddedToShoppingCart,
+        ProductItemRemovedFromShoppingCart,
+        ShoppingCartConfirmed,
+        ShoppingCartCanceled,
+    ]
+    shopping_cart_ids = [str(uuid()) for _ in range(3)]
+    streams: dict[str, list[ShoppingCartEvent]] = {
+        f"shopping_cart_{shopping_cart_id}": [
+            ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    product_item=PricedProductItem(
+                        product_id=str(uuid()), quantity=1, unit_price=Decimal("1.5")
+                    ),
+                )
+            )
+            for _ in range(20)
+        ]
+        for shopping_cart_id in shopping_cart_ids
+    }
+
+    with FileEventStore[ShoppingCartEvent](
+        tmp_path, event_types, segment_size=4096
+    ) as event_store:
+        for position in range(0, 20, 5):
+            for stream_name, events in streams.items():
+                event_store.append_events(stream_name, events[position : position + 5])
+
+    assert len(list(tmp_path.glob("*.segment"))) > 1
+    for index_recovery in IndexRecovery:
+        with FileEventStore[ShoppingCartEvent](
+            tmp_path, event_types, segment_size=4096, index_recovery=index_recovery
+        ) as event_store:
+            for stream_name, events in streams.items():
+                assert event_store.read_stream(stream_name) == events
+                assert (
+                    event_store.read_stream(stream_name, from_version=12, max_count=4)
+                    == events[12:16]
+                )
+                assert event_store.read_stream(
+                    stream_name, from_version=2, direction=ReadDirection.Backward
+                ) == [events[1], events[0]]
+            assert len(list(event_store.read_all())) == 60
+
+
+def test_file_event_store_cuts_off_torn_record(tmp_path: Path) -> None:
+    """
+    Test that a record torn by a crash is dropped on reopening, in both index
+    recovery modes, and that appends go on after the last valid record.
+    """
+    event_types: list[type[ShoppingCartEvent]] = [ProductItemAddedToShoppingCart]
+    shopping_cart_id = str(uuid())
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+    events: list[ShoppingCartEvent] = [
+        ProductItemAddedToShoppingCart(
+            data=ProductItemAddedToShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id,
+                product_item=PricedProductItem(
+                    product_id=str(uuid()), quantity=1, unit_price=Decimal("1.5")
+                ),
+            )
+        )
+        for _ in range(16)
+    ]
+
+    def open_store(
+        directory: Path, index_recovery: IndexRecovery = IndexRecovery.Checkpoint
+    ) -> FileEventStore[ShoppingCartEvent]:
+        return FileEventStore[ShoppingCartEvent](
+            directory,
+            event_types,
+            segment_size=4096,
+            fsync_policy=FsyncPolicy.Interval,
+            fsync_interval=0.01,
+            index_recovery=index_recovery,
+        )
+
+    written = tmp_path / "written"
+    # The checkpoint written on close covers the first events only
+    with open_store(written) as event_store:
+        event_store.append_events(stream_name, events[:10])
+    with open_store(written) as event_store:
+        event_store.append_events(stream_name, events[10:15])
+        crashed = tmp_path / "crashed"
+        shutil.copytree(written, crashed)
+
+    last_segment = sorted(crashed.glob("*.segment"))[-1]
+    records_end = len(last_segment.read_bytes().rstrip(b"\0"))
+    with open(last_segment, "r+b") as file:
+        file.truncate(records_end - 10)
+
+    for index_recovery in IndexRecovery:
+        recovered = tmp_path / index_recovery
+        shutil.copytree(crashed, recovered)
+        with open_store(recovered, index_recovery) as event_store:
+            assert event_store.read_stream(stream_name) == events[:14]
+            event_store.append_events(stream_name, events[15:])
+        with open_store(recovered, index_recovery) as event_store:
+            assert event_store.read_stream(stream_name) == events[:14] + events[15:]
+
+
+def test_event_store_appends_from_many_threads() -> None:
+    """
+    Test that concurrent appends keep every stream in order and reads are copies.
+    """
+    event_store: EventStore[ShoppingCartEvent] = EventStore[ShoppingCartEvent]()
+    shopping_cart_ids = [str(uuid()) for _ in range(4)]
+
+    def add_product_item(quantity: int) -> None:
+        shopping_cart_id = shopping_cart_ids[quantity % len(shopping_cart_ids)]
+        event_store.append_events(
+            f"shopping_cart_{shopping_cart_id}",
+            [
+                ProductItemAddedToShoppingCart(
+                    data=ProductItemAddedToShoppingCart.Data(
+                        shopping_cart_id=shopping_cart_id,
+                        product_item=PricedProductItem(
+                            product_id=str(uuid()),
+                            quantity=quantity,
+                            unit_price=Decimal("1"),
+                        ),
+                    )
+                )
+            ],
+        )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(add_product_item, range(400)))
+
+    assert event_store.read_stream("shopping_cart_unknown") == []
+    assert event_store.stream_version("shopping_cart_unknown") == 0
+    for shopping_cart_id in shopping_cart_ids:
+        stream_name = f"shopping_cart_{shopping_cart_id}"
+        events = event_store.read_stream(stream_name)
+        assert event_store.stream_version(stream_name) == len(events) == 100
+        assert event_store.read_stream(stream_name, from_version=90) == events[90:]
+        assert event_store.read_stream(
+            stream_name, max_count=3, direction=ReadDirection.Backward
+        ) == [events[99], events[98], events[97]]
+        assert [
+            logged.event
+            for logged in event_store.read_all()
+            if logged.stream_name == stream_name
+        ] == events
+        events.clear()
+        assert event_store.stream_version(stream_name) == 100
+    assert len(event_store.read_all(from_position=350, max_count=100)) == 50
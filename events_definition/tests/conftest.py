@@ -6,11 +6,15 @@ from sqlalchemy.orm import Session
 from testcontainers.postgres import PostgresContainer  # type: ignore
 
 
-postgres = PostgresContainer("postgres:17-alpine")
-
-
 @pytest.fixture(scope="session", autouse=True)
-def setup(request: pytest.FixtureRequest) -> str:
+def setup(
+    request: pytest.FixtureRequest, tmp_path_factory: pytest.TempPathFactory
+) -> str:
+    # DB_BACKEND=sqlite runs the tests in-process, without a container
+    if os.environ.get("DB_BACKEND") == "sqlite":
+        return f"sqlite:///{tmp_path_factory.mktemp('db') / 'events.db'}"
+
+    postgres = PostgresContainer("postgres:17-alpine")
     postgres.start()
 
     def remove_container() -> None:
@@ -0,0 +1,100 @@
+"""
+Compares the time to fold carts of growing length by evolving a frozen
+`ShoppingCart` event by event with `get_shopping_cart_from_events`, which
+folds into a mutable cart and freezes it once.
+
+Usage (from the repository root):
+
+    python -m getting_state_from_events.benchmarks.bench_fold
+"""
+
+import time
+from datetime import UTC, datetime
+from decimal import Decimal
+from typing import Callable
+from uuid import uuid4 as uuid
+
+from getting_state_from_events.src.getting_state_from_events import (
+    PricedProductItem,
+    ProductItemAddedToShoppingCart,
+    ProductItemRemovedFromShoppingCart,
+    ShoppingCart,
+    ShoppingCartEvent,
+    ShoppingCartOpened,
+    evolve,
+    get_shopping_cart_from_events,
+)
+
+LENGTHS = [100, 10_000, 100_000]
+PRODUCTS = 20
+
+
+def make_events(length: int) -> list[ShoppingCartEvent]:
+    shopping_cart_id = str(uuid())
+    product_ids = [str(uuid()) for _ in range(PRODUCTS)]
+    events: list[ShoppingCartEvent] = [
+        ShoppingCartOpened(
+            data=ShoppingCartOpened.Data(
+                shopping_cart_id=shopping_cart_id,
+                client_id=str(uuid()),
+                opened_at=datetime.now(UTC),
+            )
+        )
+    ]
+    for number in range(1, length):
+        product_item = PricedProductItem(
+            product_id=product_ids[number % PRODUCTS],
+            quantity=1,
+            unit_price=Decimal("9.99"),
+        )
+        # Every fourth event takes back an item added before
+        if number % 4 == 0:
+            events.append(
+                ProductItemRemovedFromShoppingCart(
+                    data=ProductItemRemovedFromShoppingCart.Data(
+                        shopping_cart_id=shopping_cart_id, product_item=product_item
+                    )
+                )
+            )
+        else:
+            events.append(
+                ProductItemAddedToShoppingCart(
+                    data=ProductItemAddedToShoppingCart.Data(
+                        shopping_cart_id=shopping_cart_id, product_item=product_item
+                    )
+                )
+            )
+    return events
+
+
+def fold_with_evolve(events: list[ShoppingCartEvent]) -> ShoppingCart:
+    state = ShoppingCart()
+    for event in events:
+        state = evolve(event, state)
+    return state
+
+
+def timed(
+    fold: Callable[[list[ShoppingCartEvent]], ShoppingCart],
+    events: list[ShoppingCartEvent],
+) -> tuple[float, ShoppingCart]:
+    started = time.perf_counter()
+    state = fold(events)
+    return time.perf_counter() - started, state
+
+
+def main() -> None:
+    print(f"{'events':>8} {'evolve':>12} {'builder':>12} {'speedup':>8}")
+    for length in LENGTHS:
+        events = make_events(length)
+        evolve_time, expected = timed(fold_with_evolve, events)
+        builder_time, state = timed(get_shopping_cart_from_events, events)
+        assert state == expected
+        print(
+            f"{length:>8} {evolve_time * 1000:>10.2f}ms {builder_time * 1000:>10.2f}ms"
+            f" {evolve_time / builder_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -214,8 +214,120 @@ def evolve(event: Event, state: ShoppingCart) -> ShoppingCart:
             raise ValueError(f"Unhandled event type: {event.type}")
 
 
+class _ShoppingCartBuilder:
+    """
+    Mutable cart `get_shopping_cart_from_events` folds events into and freezes
+    into a `ShoppingCart` once, instead of `evolve` rebuilding and revalidating
+    the whole cart, product items included, for every event.
+    """
+
+    __slots__ = (
+        "id",
+        "client_id",
+        "status",
+        "opened_at",
+        "confirmed_at",
+        "canceled_at",
+        "quantities",
+        "unit_prices",
+        "lines",
+    )
+
+    def __init__(self, state: ShoppingCart) -> None:
+        self._load(state)
+
+    def _load(self, state: ShoppingCart) -> None:
+        self.id = state.id
+        self.client_id = state.client_id
+        self.status = state.status
+        self.opened_at = state.opened_at
+        self.confirmed_at = state.confirmed_at
+        self.canceled_at = state.canceled_at
+        # Keyed by product id and unit price as written, like
+        # apply_product_item_added groups them, in order of first addition
+        self.quantities: dict[tuple[str, str], int] = {}
+        self.unit_prices: dict[tuple[str, str], Decimal] = {}
+        # Keys of the lines by product id and unit price as a number, equal
+        # decimals hashing alike, so a removal doesn't scan all the lines
+        self.lines: dict[tuple[str, Decimal], list[tuple[str, str]]] = {}
+        for item in state.product_items:
+            self._add(item)
+
+    def apply(self, event: Event) -> None:
+        match event:
+            case ShoppingCartOpened():
+                self._load(
+                    ShoppingCart(
+                        id=event.data.shopping_cart_id,
+                        client_id=event.data.client_id,
+                        opened_at=event.data.opened_at,
+                    )
+                )
+            case ProductItemAddedToShoppingCart():
+                self._add(event.data.product_item)
+            case ProductItemRemovedFromShoppingCart():
+                self._remove(event.data.product_item)
+            case ShoppingCartConfirmed():
+                self.confirmed_at = event.data.confirmed_at
+            case ShoppingCartCanceled():
+                self.canceled_at = event.data.canceled_at
+            case _:
+                raise ValueError(f"Unhandled event type: {event.type}")
+
+    def freeze(self) -> ShoppingCart:
+        return ShoppingCart(
+            id=self.id,
+            client_id=self.client_id,
+            status=self.status,
+            product_items=[
+                PricedProductItem(
+                    product_id=product_id,
+                    quantity=quantity,
+                    unit_price=self.unit_prices[product_id, unit_price],
+                )
+                for (product_id, unit_price), quantity in self.quantities.items()
+            ],
+            opened_at=self.opened_at,
+            confirmed_at=self.confirmed_at,
+            canceled_at=self.canceled_at,
+        )
+
+    def _add(self, item: PricedProductItem) -> None:
+        key = (item.product_id, str(item.unit_price))
+        if key in self.quantities:
+            self.quantities[key] += item.quantity
+        else:
+            self.quantities[key] = item.quantity
+            self.unit_prices[key] = item.unit_price
+            self.lines.setdefault((item.product_id, item.unit_price), []).append(key)
+
+    def _remove(self, removed_item: PricedProductItem) -> None:
+        # Unit prices compare as numbers, so removing at 2.5 takes from a 2.50
+        # line as well
+        line_key = (removed_item.product_id, removed_item.unit_price)
+        keys = self.lines.get(line_key)
+        if keys is None:
+            return
+        kept = []
+        for key in keys:
+            quantity = self.quantities[key] - removed_item.quantity
+            if quantity > 0:
+                self.quantities[key] = quantity
+                kept.append(key)
+            else:
+                del self.quantities[key]
+                del self.unit_prices[key]
+        if kept:
+            self.lines[line_key] = kept
+        else:
+            del self.lines[line_key]
+
+
 def get_shopping_cart_from_events(events: list[ShoppingCartEvent]) -> ShoppingCart:
-    state = ShoppingCart()
+    """
+    Folds the events like `evolve` would, into a mutable cart frozen once.
+    """
+    builder = _ShoppingCartBuilder(ShoppingCart())
     for event in events:
-        state = evolve(event, state)
-    return state
+        builder.apply(event)
+    return builder.freeze()
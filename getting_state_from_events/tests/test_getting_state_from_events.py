@@ -6,8 +6,10 @@ from datetime import datetime, UTC
 
 from getting_state_from_events.src.getting_state_from_events import (
     ProductItemRemovedFromShoppingCart,
+    ShoppingCart,
     ShoppingCartCanceled,
     ShoppingCartConfirmed,
+    evolve,
     get_shopping_cart_from_events,
     ShoppingCartStatus,
     PricedProductItem,
@@ -81,3 +83,74 @@ class TestGettingStateFromEvents(unittest.TestCase):
         assert shopping_cart.opened_at == current_time
         assert shopping_cart.confirmed_at == confirmed_at
         assert shopping_cart.canceled_at == canceled_at
+
+    def test_should_fold_to_the_same_state_as_evolve(self) -> None:
+        """
+        Test that the mutable fold matches evolving a frozen cart event by event.
+        """
+        shopping_cart_id = str(uuid())
+        shoes_id, t_shirt_id = str(uuid()), str(uuid())
+
+        def opened() -> ShoppingCartOpened:
+            return ShoppingCartOpened(
+                data=ShoppingCartOpened.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    client_id=str(uuid()),
+                    opened_at=datetime.now(UTC),
+                )
+            )
+
+        def added(
+            product_id: str, quantity: int, unit_price: str
+        ) -> ProductItemAddedToShoppingCart:
+            return ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    product_item=PricedProductItem(
+                        product_id=product_id,
+                        quantity=quantity,
+                        unit_price=Decimal(unit_price),
+                    ),
+                )
+            )
+
+        def removed(
+            product_id: str, quantity: int, unit_price: str
+        ) -> ProductItemRemovedFromShoppingCart:
+            return ProductItemRemovedFromShoppingCart(
+                data=ProductItemRemovedFromShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    product_item=PricedProductItem(
+                        product_id=product_id,
+                        quantity=quantity,
+                        unit_price=Decimal(unit_price),
+                    ),
+                )
+            )
+
+        events: list[ShoppingCartEvent] = [
+            opened(),
+            added(shoes_id, 1, "100"),
+            opened(),
+            added(shoes_id, 2, "100"),
+            added(t_shirt_id, 3, "2.5"),
+            added(t_shirt_id, 1, "2.50"),
+            added(shoes_id, 1, "90"),
+            removed(t_shirt_id, 1, "2.5"),
+            removed(shoes_id, 2, "100"),
+            added(shoes_id, 4, "100"),
+            ShoppingCartConfirmed(
+                data=ShoppingCartConfirmed.Data(
+                    shopping_cart_id=shopping_cart_id, confirmed_at=datetime.now(UTC)
+                )
+            ),
+        ]
+
+        expected = ShoppingCart()
+        for event in events:
+            expected = evolve(event, expected)
+        assert get_shopping_cart_from_events(events) == expected
+        assert [
+            (item.product_id, item.quantity, str(item.unit_price))
+            for item in expected.product_items
+        ] == [(t_shirt_id, 2, "2.5"), (shoes_id, 1, "90"), (shoes_id, 4, "100")]
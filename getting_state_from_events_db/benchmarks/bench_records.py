@@ -0,0 +1,147 @@
+"""
+Compares the memory held per loaded event and the fold of a cart as pydantic
+events with the same events as compact records. Events are decoded from their
+stored JSON payloads with the event codec, as `read_stream` does.
+
+Memory is traced with tracemalloc, folds are timed in a separate untraced run.
+A record's memory includes the strings and datetimes it keeps once the events
+it was made of are gone.
+
+Usage (from the repository root):
+
+    EVENTS=20000 python -m getting_state_from_events_db.benchmarks.bench_records
+"""
+
+import gc
+import os
+import time
+import tracemalloc
+from datetime import UTC, datetime
+from decimal import Decimal
+from typing import Callable
+from uuid import uuid4 as uuid
+
+from getting_state_from_events_db.src.getting_state_from_events_db import (
+    PricedProductItem,
+    ProductItemAddedToShoppingCart,
+    ProductItemRemovedFromShoppingCart,
+    ShoppingCart,
+    ShoppingCartEvent,
+    ShoppingCartOpened,
+    event_codec,
+    evolve,
+    get_shopping_cart_from_events,
+    get_shopping_cart_from_records,
+    to_record,
+)
+from getting_state_from_events_db.src.getting_state_from_events_db.model import (
+    PayloadFormat,
+    encode_payload,
+)
+
+EVENTS = int(os.environ.get("EVENTS", 20_000))
+PRODUCTS = 20
+
+
+def stored_events() -> list[tuple[str, str, str | bytes, int | None]]:
+    shopping_cart_id = str(uuid())
+    product_ids = [str(uuid()) for _ in range(PRODUCTS)]
+    events: list[ShoppingCartEvent] = [
+        ShoppingCartOpened(
+            data=ShoppingCartOpened.Data(
+                shopping_cart_id=shopping_cart_id,
+                client_id=str(uuid()),
+                opened_at=datetime.now(UTC),
+            )
+        )
+    ]
+    for number in range(1, EVENTS):
+        product_item = PricedProductItem(
+            product_id=product_ids[number % PRODUCTS],
+            quantity=1,
+            unit_price=Decimal("9.99"),
+        )
+        # Every fourth event takes back an item added before
+        events.append(
+            ProductItemRemovedFromShoppingCart(
+                data=ProductItemRemovedFromShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id, product_item=product_item
+                )
+            )
+            if number % 4 == 0
+            else ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id, product_item=product_item
+                )
+            )
+        )
+    return [
+        (
+            event.type,
+            PayloadFormat.Json,
+            str(encode_payload(event.data, PayloadFormat.Json)),
+            None,
+        )
+        for event in events
+    ]
+
+
+def fold_with_evolve(events: list[ShoppingCartEvent]) -> ShoppingCart:
+    state = ShoppingCart()
+    for event in events:
+        state = evolve(event, state)
+    return state
+
+
+def traced_fold[E](
+    name: str, fold: Callable[[list[E]], ShoppingCart], events: list[E]
+) -> ShoppingCart:
+    gc.collect()
+    started = time.perf_counter()
+    state = fold(events)
+    elapsed = time.perf_counter() - started
+    # Traced apart, tracing slows down allocations
+    tracemalloc.start()
+    fold(events)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>24} {elapsed * 1000:>10.2f}ms {peak / 1024:>10.0f}KiB peak"
+        f" {peak / len(events):>8.1f}B/event"
+    )
+    return state
+
+
+def main() -> None:
+    rows = stored_events()
+
+    gc.collect()
+    tracemalloc.start()
+    events = event_codec.decode(rows)
+    events_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    gc.collect()
+    tracemalloc.start()
+    records = [to_record(event) for event in event_codec.decode(rows)]
+    gc.collect()
+    records_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{EVENTS} events of a cart with {PRODUCTS} products\n")
+    print(f"{'pydantic events':>24} {events_size / EVENTS:>8.0f} B/event")
+    print(f"{'records':>24} {records_size / EVENTS:>8.0f} B/event\n")
+
+    expected = traced_fold("evolve", fold_with_evolve, events)
+    assert (
+        traced_fold("builder from events", get_shopping_cart_from_events, events)
+        == expected
+    )
+    assert (
+        traced_fold("builder from records", get_shopping_cart_from_records, records)
+        == expected
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
 from decimal import Decimal
-from typing import Literal, ClassVar
+from typing import Any, Callable, Literal, ClassVar
 from pydantic import BaseModel, ConfigDict
 from datetime import datetime
 from enum import StrEnum
 
-from .event_store import EventStore, EventStream
-from .model import Event
-from typing import Callable
+import time
+from concurrent.futures import Executor
+from itertools import repeat
+from .event_store import (
+    AppendResult,
+    EventRow,
+    EventStore,
+    EventStream,
+    StreamEventRow,
+)
+from .model import Event, EventCodec, PayloadDictionaries, decode_payload
+from .records import (
+    ProductItemAddedRecord,
+    ProductItemRemovedRecord,
+    ShoppingCartCanceledRecord,
+    ShoppingCartConfirmedRecord,
+    ShoppingCartOpenedRecord,
+    ShoppingCartRecord,
+    from_fixed_point,
+    normalize_fixed_point,
+    parse_fixed_point,
+    to_fixed_point,
+)
+from .snapshots import SnapshotStore
+from itertools import batched
+from typing import Iterable, Iterator
 
 
 class ShoppingCartStatus(StrEnum):
@@ -211,40 +234,440 @@ def evolve(event: Event, state: ShoppingCart) -> ShoppingCart:
             raise ValueError(f"Unhandled event type: {event.type}")
 
 
-def get_shopping_cart_from_events(events: list[ShoppingCartEvent]) -> ShoppingCart:
-    state = ShoppingCart()
+class _ShoppingCartBuilder:
+    """
+    Mutable cart `get_shopping_cart_from_events` and
+    `get_shopping_cart_from_records` fold into and freeze into a `ShoppingCart`
+    once, instead of `evolve` rebuilding and revalidating the whole cart,
+    product items included, for every event.
+    """
+
+    __slots__ = (
+        "id",
+        "client_id",
+        "status",
+        "opened_at",
+        "confirmed_at",
+        "canceled_at",
+        "quantities",
+        "lines",
+    )
+
+    def __init__(self, state: ShoppingCart) -> None:
+        self._load(state)
+
+    def _load(self, state: ShoppingCart) -> None:
+        self.id = state.id
+        self.client_id = state.client_id
+        self.status = state.status
+        self.opened_at = state.opened_at
+        self.confirmed_at = state.confirmed_at
+        self.canceled_at = state.canceled_at
+        # Keyed by product id and fixed-point unit price as written, like
+        # apply_product_item_added groups them, in order of first addition
+        self.quantities: dict[tuple[str, int, int], int] = {}
+        # Keys of the lines by product id and normalized unit price, so a
+        # removal finds the lines of equal price without scanning them all
+        self.lines: dict[tuple[str, int, int], list[tuple[str, int, int]]] = {}
+        for item in state.product_items:
+            self._add(item.product_id, item.quantity, *to_fixed_point(item.unit_price))
+
+    def apply(self, event: Event) -> None:
+        match event:
+            case ShoppingCartOpened():
+                self._open(
+                    event.data.shopping_cart_id,
+                    event.data.client_id,
+                    event.data.opened_at,
+                )
+            case ProductItemAddedToShoppingCart():
+                item = event.data.product_item
+                self._add(
+                    item.product_id, item.quantity, *to_fixed_point(item.unit_price)
+                )
+            case ProductItemRemovedFromShoppingCart():
+                item = event.data.product_item
+                self._remove(
+                    item.product_id, item.quantity, *to_fixed_point(item.unit_price)
+                )
+            case ShoppingCartConfirmed():
+                self.confirmed_at = event.data.confirmed_at
+            case ShoppingCartCanceled():
+                self.canceled_at = event.data.canceled_at
+            case _:
+                raise ValueError(f"Unhandled event type: {event.type}")
+
+    def apply_record(self, record: ShoppingCartRecord) -> None:
+        match record:
+            case ShoppingCartOpenedRecord():
+                self._open(*record)
+            case ProductItemAddedRecord():
+                self._add(*record)
+            case ProductItemRemovedRecord():
+                self._remove(*record)
+            case ShoppingCartConfirmedRecord():
+                self.confirmed_at = record.confirmed_at
+            case ShoppingCartCanceledRecord():
+                self.canceled_at = record.canceled_at
+
+    def freeze(self) -> ShoppingCart:
+        return ShoppingCart(
+            id=self.id,
+            client_id=self.client_id,
+            status=self.status,
+            product_items=[
+                PricedProductItem(
+                    product_id=product_id,
+                    quantity=quantity,
+                    unit_price=from_fixed_point(coefficient, exponent),
+                )
+                for (product_id, coefficient, exponent), quantity in (
+                    self.quantities.items()
+                )
+            ],
+            opened_at=self.opened_at,
+            confirmed_at=self.confirmed_at,
+            canceled_at=self.canceled_at,
+        )
+
+    def _open(self, shopping_cart_id: str, client_id: str, opened_at: datetime) -> None:
+        self._load(
+            ShoppingCart(id=shopping_cart_id, client_id=client_id, opened_at=opened_at)
+        )
+
+    def _add(
+        self, product_id: str, quantity: int, coefficient: int, exponent: int
+    ) -> None:
+        key = (product_id, coefficient, exponent)
+        current = self.quantities.get(key)
+        if current is None:
+            self.quantities[key] = quantity
+            self.lines.setdefault(
+                (product_id, *normalize_fixed_point(coefficient, exponent)), []
+            ).append(key)
+        else:
+            self.quantities[key] = current + quantity
+
+    def _remove(
+        self, product_id: str, quantity: int, coefficient: int, exponent: int
+    ) -> None:
+        # Unit prices compare as numbers, so removing at 2.5 takes from a 2.50
+        # line as well
+        line_key = (product_id, *normalize_fixed_point(coefficient, exponent))
+        keys = self.lines.get(line_key)
+        if keys is None:
+            return
+        kept = []
+        for key in keys:
+            remaining = self.quantities[key] - quantity
+            if remaining > 0:
+                self.quantities[key] = remaining
+                kept.append(key)
+            else:
+                del self.quantities[key]
+        if kept:
+            self.lines[line_key] = kept
+        else:
+            del self.lines[line_key]
+
+
+def get_shopping_cart_from_events(
+    events: Iterable[ShoppingCartEvent],
+) -> ShoppingCart:
+    """
+    Folds the events like `evolve` would, into a mutable cart frozen once.
+    """
+    builder = _ShoppingCartBuilder(ShoppingCart())
     for event in events:
-        state = evolve(event, state)
-    return state
+        builder.apply(event)
+    return builder.freeze()
 
 
-def append_to_stream(
-    event_store: EventStore, stream_name: str, events: list[ShoppingCartEvent]
-) -> None:
-    event_store.append_events(stream_name, events)
-
-
-def read_stream(event_store: EventStore, stream_name: str) -> list[ShoppingCartEvent]:
-    events = event_store.read_stream(stream_name)
-    event_handlers: dict[str, Callable[[EventStream], ShoppingCartEvent]] = {
-        ShoppingCartOpened.type: lambda e: ShoppingCartOpened(
-            data=ShoppingCartOpened.Data.model_validate_json(str(e.event_data))
-        ),
-        ProductItemAddedToShoppingCart.type: lambda e: ProductItemAddedToShoppingCart(
-            data=ProductItemAddedToShoppingCart.Data.model_validate_json(
-                str(e.event_data)
+def to_record(event: Event) -> ShoppingCartRecord:
+    """
+    Converts an event into the compact record `get_shopping_cart_from_records`
+    folds, leaving out what the fold doesn't read.
+    """
+    match event:
+        case ShoppingCartOpened():
+            return ShoppingCartOpenedRecord(
+                event.data.shopping_cart_id, event.data.client_id, event.data.opened_at
             )
-        ),
-        ProductItemRemovedFromShoppingCart.type: lambda e: ProductItemRemovedFromShoppingCart(
-            data=ProductItemRemovedFromShoppingCart.Data.model_validate_json(
-                str(e.event_data)
+        case ProductItemAddedToShoppingCart():
+            item = event.data.product_item
+            return ProductItemAddedRecord(
+                item.product_id, item.quantity, *to_fixed_point(item.unit_price)
             )
-        ),
-        ShoppingCartConfirmed.type: lambda e: ShoppingCartConfirmed(
-            data=ShoppingCartConfirmed.Data.model_validate_json(str(e.event_data))
-        ),
-        ShoppingCartCanceled.type: lambda e: ShoppingCartCanceled(
-            data=ShoppingCartCanceled.Data.model_validate_json(str(e.event_data))
-        ),
+        case ProductItemRemovedFromShoppingCart():
+            item = event.data.product_item
+            return ProductItemRemovedRecord(
+                item.product_id, item.quantity, *to_fixed_point(item.unit_price)
+            )
+        case ShoppingCartConfirmed():
+            return ShoppingCartConfirmedRecord(event.data.confirmed_at)
+        case ShoppingCartCanceled():
+            return ShoppingCartCanceledRecord(event.data.canceled_at)
+        case _:
+            raise ValueError(f"Unhandled event type: {event.type}")
+
+
+def get_shopping_cart_from_records(
+    records: Iterable[ShoppingCartRecord],
+) -> ShoppingCart:
+    """
+    Folds compact records into the same cart `get_shopping_cart_from_events`
+    returns for the events they were made of.
+    """
+    builder = _ShoppingCartBuilder(ShoppingCart())
+    for record in records:
+        builder.apply_record(record)
+    return builder.freeze()
+
+
+# Event type, payload format, payload and dictionary id, as the codec takes them
+type StoredEvent = tuple[str, str, str | bytes, int | None]
+
+
+def record_from_payload(event_type: str, data: dict[str, Any]) -> ShoppingCartRecord:
+    """
+    Builds the record of a stored event straight from its parsed payload,
+    reading only the fields the fold needs and trusting them to be valid.
+    """
+    read = _payload_readers.get(event_type)
+    if read is None:
+        raise ValueError(f"Unhandled event type: {event_type}")
+    return read(data)
+
+
+def _datetime(value: str | datetime) -> datetime:
+    # JSON holds ISO text, MessagePack aware datetimes
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def _read_opened(data: dict[str, Any]) -> ShoppingCartRecord:
+    return ShoppingCartOpenedRecord(
+        data["shopping_cart_id"], data["client_id"], _datetime(data["opened_at"])
+    )
+
+
+def _read_added(data: dict[str, Any]) -> ShoppingCartRecord:
+    item = data["product_item"]
+    return ProductItemAddedRecord(
+        item["product_id"], item["quantity"], *parse_fixed_point(item["unit_price"])
+    )
+
+
+def _read_removed(data: dict[str, Any]) -> ShoppingCartRecord:
+    item = data["product_item"]
+    return ProductItemRemovedRecord(
+        item["product_id"], item["quantity"], *parse_fixed_point(item["unit_price"])
+    )
+
+
+_payload_readers: dict[str, Callable[[dict[str, Any]], ShoppingCartRecord]] = {
+    ShoppingCartOpened.type: _read_opened,
+    ProductItemAddedToShoppingCart.type: _read_added,
+    ProductItemRemovedFromShoppingCart.type: _read_removed,
+    ShoppingCartConfirmed.type: lambda data: ShoppingCartConfirmedRecord(
+        _datetime(data["confirmed_at"])
+    ),
+    ShoppingCartCanceled.type: lambda data: ShoppingCartCanceledRecord(
+        _datetime(data["canceled_at"])
+    ),
+}
+
+
+def get_shopping_cart_from_rows(
+    rows: Iterable[EventStream | EventRow | StreamEventRow],
+    dictionaries: PayloadDictionaries | None = None,
+    strict: bool = False,
+) -> ShoppingCart:
+    """
+    Folds stored events without building pydantic events. They were validated
+    when appended, so each payload is only parsed and read by
+    `record_from_payload`. With `strict`, they are decoded and validated by the
+    event codec like `read_stream` does.
+    """
+    builder = _ShoppingCartBuilder(ShoppingCart())
+    _fold_stored_events(builder, map(_stored_event, rows), dictionaries, strict)
+    return builder.freeze()
+
+
+def _fold_stored_events(
+    builder: _ShoppingCartBuilder,
+    events: Iterable[StoredEvent],
+    dictionaries: PayloadDictionaries | None,
+    strict: bool,
+) -> int:
+    """
+    Applies the stored events to the builder and returns how many there were.
+    """
+    count = 0
+    if strict:
+        for batch in batched(events, 500):
+            for event in event_codec.decode(batch, dictionaries):
+                builder.apply(event)
+            count += len(batch)
+        return count
+    for event_type, payload_format, payload, dictionary_id in events:
+        data = decode_payload(payload_format, payload, dictionary_id, dictionaries)
+        builder.apply_record(record_from_payload(event_type, data))
+        count += 1
+    return count
+
+
+def append_to_stream(
+    event_store: EventStore,
+    stream_name: str,
+    events: list[ShoppingCartEvent],
+    snapshot_store: SnapshotStore[ShoppingCart] | None = None,
+) -> AppendResult:
+    """
+    Appends the events and, when a snapshot store is passed, takes a snapshot
+    of the cart once its policy says enough events were appended since the last.
+    """
+    result = event_store.append_events(stream_name, events)
+    if snapshot_store is not None:
+        events_since_snapshot = (
+            result.next_expected_stream_version
+            - snapshot_store.latest_version(stream_name)
+        )
+        if snapshot_store.policy.should_snapshot(events_since_snapshot, 0.0):
+            get_shopping_cart(event_store, snapshot_store, stream_name)
+    return result
+
+
+def read_stream(
+    event_store: EventStore, stream_name: str, from_version: int = 0
+) -> list[ShoppingCartEvent]:
+    return list(
+        decode_events(
+            event_store.read_stream_rows(stream_name, from_version),
+            event_store.dictionaries,
+        )
+    )
+
+
+def iter_stream(
+    event_store: EventStore, stream_name: str, from_version: int = 0
+) -> Iterator[ShoppingCartEvent]:
+    """
+    Lazily decodes the events of the stream while they are fetched.
+    """
+    return decode_events(
+        event_store.iter_stream(stream_name, from_version), event_store.dictionaries
+    )
+
+
+def get_shopping_cart(
+    event_store: EventStore,
+    snapshot_store: SnapshotStore[ShoppingCart],
+    stream_name: str,
+    strict: bool = False,
+) -> tuple[ShoppingCart, int]:
+    """
+    Rebuilds the cart from its latest snapshot and the events appended after it,
+    and returns it with the stream version it reflects.
+    Stores a new snapshot when the snapshot policy asks for one.
+    The tail is folded from the stored rows, see `get_shopping_cart_from_rows`.
+    """
+    snapshot = snapshot_store.load(stream_name)
+    state, snapshot_version = snapshot or (ShoppingCart(), 0)
+
+    started = time.perf_counter()
+    builder = _ShoppingCartBuilder(state)
+    tail_length = _fold_stored_events(
+        builder,
+        map(_stored_event, event_store.iter_stream(stream_name, snapshot_version)),
+        event_store.dictionaries,
+        strict,
+    )
+    state = builder.freeze()
+    fold_time = time.perf_counter() - started
+
+    # Stream positions have no gaps, so the tail length gives the version
+    stream_version = snapshot_version + tail_length
+    if snapshot_store.policy.should_snapshot(tail_length, fold_time):
+        snapshot_store.store(stream_name, stream_version, state)
+    return state, stream_version
+
+
+def get_shopping_carts(
+    event_store: EventStore,
+    stream_names: Iterable[str],
+    executor: Executor | None = None,
+    chunk_size: int = 1000,
+    strict: bool = False,
+) -> dict[str, ShoppingCart]:
+    """
+    Rebuilds many carts from their whole streams, fetched together with
+    `EventStore.read_streams` instead of one query per cart. With an executor,
+    typically a `ProcessPoolExecutor`, the streams are decoded and folded
+    there, `chunk_size` streams per task. Streams are folded from the stored
+    rows, see `get_shopping_cart_from_rows`.
+    """
+    streams = [
+        (stream_name, [_stored_event(row) for row in rows])
+        for stream_name, rows in event_store.read_streams(stream_names).items()
+    ]
+    if executor is None:
+        return dict(_fold_streams(streams, event_store.dictionaries, strict))
+    return {
+        stream_name: shopping_cart
+        for folded in executor.map(
+            _fold_streams,
+            batched(streams, chunk_size),
+            repeat(event_store.dictionaries),
+            repeat(strict),
+        )
+        for stream_name, shopping_cart in folded
     }
-    return [event_handlers[str(event.event_type)](event) for event in events]
+
+
+def _fold_streams(
+    streams: Iterable[tuple[str, list[StoredEvent]]],
+    dictionaries: PayloadDictionaries,
+    strict: bool,
+) -> list[tuple[str, ShoppingCart]]:
+    # Module level, so a process pool can pickle it
+    folded = []
+    for stream_name, events in streams:
+        builder = _ShoppingCartBuilder(ShoppingCart())
+        _fold_stored_events(builder, events, dictionaries, strict)
+        folded.append((stream_name, builder.freeze()))
+    return folded
+
+
+event_codec = EventCodec(
+    ShoppingCartOpened,
+    ProductItemAddedToShoppingCart,
+    ProductItemRemovedFromShoppingCart,
+    ShoppingCartConfirmed,
+    ShoppingCartCanceled,
+)
+
+
+def decode_events(
+    events: Iterable[EventStream | EventRow | StreamEventRow],
+    dictionaries: PayloadDictionaries | None = None,
+    batch_size: int = 500,
+) -> Iterator[ShoppingCartEvent]:
+    """
+    Lazily decodes stored events with the event codec, `batch_size` at a time.
+    Compressed payloads are decompressed with `dictionaries`.
+    """
+    for batch in batched(events, batch_size):
+        yield from event_codec.decode(
+            (_stored_event(event) for event in batch), dictionaries
+        )
+
+
+def _stored_event(event: EventStream | EventRow | StreamEventRow) -> StoredEvent:
+    return (
+        str(event.event_type),
+        event.payload_format,
+        event.event_payload
+        if event.event_payload is not None
+        else str(event.event_data),
+        event.dictionary_id,
+    )
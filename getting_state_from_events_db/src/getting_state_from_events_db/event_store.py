@@ -1,40 +1,1357 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import Column, String
-from sqlalchemy.dialects.postgresql import JSONB, UUID
-from .model import Event, Base
+import csv
+import io
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, timedelta
+from enum import StrEnum
+from itertools import batched, groupby, takewhile
+from operator import attrgetter
+from contextlib import AbstractContextManager, contextmanager
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+from sqlalchemy.engine import Connection, Dialect, Engine, Row, make_url
+from sqlalchemy.exc import UnboundExecutionError
+from sqlalchemy.sql.elements import ColumnElement
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import ConnectionPoolEntry, QueuePool
+from sqlalchemy import (
+    BigInteger,
+    BindParameter,
+    Column,
+    Executable,
+    FunctionElement,
+    Identity,
+    Index,
+    Integer,
+    DateTime,
+    LargeBinary,
+    MetaData,
+    PrimaryKeyConstraint,
+    Select,
+    String,
+    Table,
+    Text,
+    TypeDecorator,
+    UniqueConstraint,
+    Uuid,
+    cast,
+    create_engine,
+    event,
+    func,
+    insert,
+    literal,
+    select,
+    tablesample,
+    text,
+    true,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.compiler import SQLCompiler
+from .model import (
+    Event,
+    Base,
+    PayloadDictionaries,
+    PayloadFormat,
+    encode_payload,
+)
 import uuid
 from sqlalchemy.orm import Mapped, mapped_column
 
+try:
+    import zstandard
+except ImportError:  # Only needed for compressed payloads
+    zstandard = None  # type: ignore[assignment]
+
+
+class _AsJSONB(FunctionElement[str]):
+    inherit_cache = True
+
+
+@compiles(_AsJSONB)
+def _compile_as_jsonb(element: _AsJSONB, compiler: SQLCompiler, **kw: Any) -> str:
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(_AsJSONB, "postgresql")
+def _compile_as_jsonb_postgresql(
+    element: _AsJSONB, compiler: SQLCompiler, **kw: Any
+) -> str:
+    return f"CAST({compiler.process(element.clauses, **kw)} AS JSONB)"
+
+
+class JSONBText(TypeDecorator[str]):
+    """
+    JSONB column exchanged with the database as JSON text.
+    Payloads serialized by pydantic are cast to JSONB by Postgres without being
+    encoded again, and are read back as text for a single `model_validate_json`
+    instead of being parsed by the driver first. Other databases store the text.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect: Dialect) -> Any:
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(JSONB())  # type: ignore[no-untyped-call]
+        return dialect.type_descriptor(Text())
+
+    def bind_processor(self, dialect: Dialect) -> None:
+        return None
+
+    def result_processor(self, dialect: Dialect, coltype: object) -> None:
+        return None
+
+    def bind_expression(self, bindvalue: BindParameter[str]) -> ColumnElement[str]:
+        return _AsJSONB(bindvalue)
+
+    def column_expression(self, column: ColumnElement[str]) -> ColumnElement[str]:
+        return cast(column, Text)
+
+
+class _CurrentTransactionId(FunctionElement[int]):
+    type = BigInteger()
+    inherit_cache = True
+
+
+@compiles(_CurrentTransactionId)
+def _compile_current_transaction_id(
+    element: _CurrentTransactionId, compiler: SQLCompiler, **kw: Any
+) -> str:
+    # Writers of other databases are serialized, read_all has nothing to wait for
+    return "0"
+
+
+@compiles(_CurrentTransactionId, "postgresql")
+def _compile_current_transaction_id_postgresql(
+    element: _CurrentTransactionId, compiler: SQLCompiler, **kw: Any
+) -> str:
+    return "pg_current_xact_id()::text::bigint"
+
 
 class EventStream(Base):
     __tablename__ = "event_streams"
 
     id: Mapped[uuid.UUID] = mapped_column(
-        UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True
+        Uuid, primary_key=True, default=uuid.uuid4, unique=True
     )
     stream_name = Column(String, nullable=False)
-    event_data = Column(JSONB, nullable=False)
+    stream_position: Mapped[int] = mapped_column(BigInteger)
+    # Global order of events in the whole log
+    log_position: Mapped[int] = mapped_column(BigInteger, Identity())
+    # Id of the appending transaction, tells read_all which positions are settled
+    transaction_id: Mapped[int] = mapped_column(
+        BigInteger, server_default=_CurrentTransactionId()
+    )
     event_type = Column(String, nullable=False)
+    # Tells which of the payload columns below holds the event data
+    payload_format: Mapped[str] = mapped_column(
+        String, server_default=PayloadFormat.Json.value
+    )
+    event_data = Column(JSONBText, nullable=True)
+    event_payload: Mapped[bytes | None] = mapped_column(LargeBinary)
+    # Set once the payload was moved to event_payload compressed with this dictionary
+    dictionary_id: Mapped[int | None] = mapped_column(BigInteger)
+
+    __table_args__ = (
+        Index(
+            "ix_event_streams_stream_name_stream_position",
+            "stream_name",
+            "stream_position",
+            unique=True,
+        ),
+        Index("ix_event_streams_log_position", "log_position", unique=True),
+        Index(
+            "ix_event_streams_transaction_id_log_position",
+            "transaction_id",
+            "log_position",
+        ),
+    )
+
+
+# One row per stream holding its current version. Appends claim their positions
+# by moving the head, so the version check is a primary key lookup however long
+# the stream is, and the row lock only makes writers of the same stream wait.
+stream_heads = Table(
+    "stream_heads",
+    Base.metadata,
+    Column("stream_name", String, primary_key=True),
+    Column("stream_position", BigInteger, nullable=False),
+)
+
+
+# Zstandard dictionaries trained from stored payloads. New dictionaries get new
+# ids, so rows compressed with an older one stay readable.
+payload_dictionaries = Table(
+    "payload_dictionaries",
+    Base.metadata,
+    Column(
+        "id",
+        BigInteger().with_variant(Integer, "sqlite"),
+        Identity(),
+        primary_key=True,
+    ),
+    Column("dictionary_data", LargeBinary, nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+# Event type and payload of an event read without the ORM
+type EventRow = Row[tuple[str, str, str | None, bytes | None, int | None]]
+# The same, preceded by the name of the stream the event belongs to
+type StreamEventRow = Row[tuple[str, str, str, str | None, bytes | None, int | None]]
+
+
+class LogPosition(NamedTuple):
+    """
+    Where a consumer of `read_all` is in the log: the transaction id and log
+    position of the last event it read.
+    """
+
+    transaction_id: int = 0
+    log_position: int = 0
+
+    @classmethod
+    def of(cls, event: EventStream) -> "LogPosition":
+        return cls(event.transaction_id, event.log_position)
+
+
+class StreamState(StrEnum):
+    Any = "Any"
+    NoStream = "NoStream"
+    StreamExists = "StreamExists"
+
+
+type ExpectedStreamVersion = int | StreamState
+
+
+class ReadDirection(StrEnum):
+    Forward = "forward"
+    Backward = "backward"
+
+
+class ExpectedVersionConflictError(Exception):
+    def __init__(
+        self,
+        stream_name: str,
+        expected_version: ExpectedStreamVersion,
+        actual_version: int,
+    ):
+        super().__init__(
+            f"Expected stream '{stream_name}' to be at version {expected_version}, "
+            f"but it is at version {actual_version}"
+        )
+        self.stream_name = stream_name
+        self.expected_version = expected_version
+        self.actual_version = actual_version
+
+
+class AppendResult(BaseModel):
+    event_ids: list[uuid.UUID]
+    log_positions: list[int]
+    next_expected_stream_version: int
+
+    model_config = ConfigDict(frozen=True)
+
+
+class PartitionStrategy(StrEnum):
+    # By hash of the stream name, so all events of a stream share a partition
+    Hash = "hash"
+    # By month of the append time, so old events can be detached or dropped
+    Range = "range"
+
+
+class EventPartitioning(BaseModel):
+    """
+    Layout of a partitioned `event_streams` table: `partitions` hash partitions,
+    or `partitions` monthly partitions starting with the month of `start`
+    followed by a default partition.
+    """
+
+    strategy: PartitionStrategy = PartitionStrategy.Hash
+    partitions: int = 16
+    start: date | None = None
+
+    model_config = ConfigDict(frozen=True)
+
+
+def create_event_tables(
+    engine: Engine, partitioning: EventPartitioning | None = None
+) -> None:
+    """
+    Creates the tables of the event store, with `event_streams` declaratively
+    partitioned when `partitioning` is given.
+
+    Postgres requires unique indexes of a partitioned table to include the
+    partition key. The primary key becomes (id, partition key) and the log
+    position index isn't unique anymore; with range partitions the stream
+    position index isn't unique either, `stream_heads` still hands out every
+    position once.
+    """
+    if partitioning is not None and engine.dialect.name != "postgresql":
+        raise ValueError("Partitioned event tables need Postgres")
+    with engine.begin() as connection:
+        if partitioning is not None:
+            _create_partitioned_event_streams(connection, partitioning)
+        Base.metadata.create_all(connection)
+
+
+def _create_partitioned_event_streams(
+    connection: Connection, partitioning: EventPartitioning
+) -> None:
+    event_streams = EventStream.__table__
+    assert isinstance(event_streams, Table)
+    table = event_streams.to_metadata(MetaData())
+    partition_key = (
+        table.c.stream_name
+        if partitioning.strategy == PartitionStrategy.Hash
+        else table.c.created_at
+    )
+    table.constraints -= {
+        constraint
+        for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint)
+    }
+    partition_key.primary_key = True
+    table.append_constraint(PrimaryKeyConstraint(table.c.id, partition_key))
+    table.dialect_options["postgresql"]["partition_by"] = (
+        f"{partitioning.strategy.upper()} ({partition_key.name})"
+    )
+    for index in list(table.indexes):
+        index.unique = bool(index.unique) and partition_key.name in index.columns
+    table.create(connection, checkfirst=True)
+
+    if partitioning.strategy == PartitionStrategy.Hash:
+        bounds = [
+            f"WITH (MODULUS {partitioning.partitions}, REMAINDER {remainder})"
+            for remainder in range(partitioning.partitions)
+        ]
+    else:
+        start = (partitioning.start or date.today()).replace(day=1)
+        months = [
+            _add_months(start, month) for month in range(partitioning.partitions + 1)
+        ]
+        bounds = [
+            f"FROM ('{month_start}') TO ('{month_end}')"
+            for month_start, month_end in zip(months, months[1:])
+        ]
+    for number, bound in enumerate(bounds):
+        connection.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {table.name}_{number} "
+                f"PARTITION OF {table.name} FOR VALUES {bound}"
+            )
+        )
+    if partitioning.strategy == PartitionStrategy.Range:
+        connection.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {table.name}_default "
+                f"PARTITION OF {table.name} DEFAULT"
+            )
+        )
+
+
+def _add_months(day: date, months: int) -> date:
+    years, month = divmod(day.month - 1 + months, 12)
+    return day.replace(year=day.year + years, month=month + 1)
+
+
+def create_sqlite_engine(url: str, busy_timeout: float = 5, **kwargs: Any) -> Engine:
+    """
+    Creates an engine for an SQLite database file in WAL mode, so readers don't
+    block the writer nor each other. SQLite has one writer at a time: the first
+    write of a transaction waits up to `busy_timeout` seconds for the database
+    lock, and appends write their stream head first, which serializes them like
+    the row lock of the stream head does on Postgres.
+    """
+    engine = create_engine(url, **kwargs)
+
+    @event.listens_for(engine, "connect")
+    def configure(dbapi_connection: Any, _: ConnectionPoolEntry) -> None:
+        # The driver would only BEGIN before writes, reads need it too
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin(connection: Connection) -> None:
+        connection.exec_driver_sql("BEGIN")
+
+    return engine
+
+
+def upsert(db_session: Session, table: Table) -> postgresql.Insert | sqlite.Insert:
+    """
+    Returns an INSERT of the session's dialect, with its ON CONFLICT clauses.
+    """
+    if _dialect_name(db_session) == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+def _dialect_name(db_session: Session) -> str:
+    return db_session.get_bind().dialect.name
+
+
+@contextmanager
+def session_scope(db_session: Session | sessionmaker[Session]) -> Iterator[Session]:
+    """
+    Yields the session, or a new session of the factory that is closed on exit.
+    """
+    if isinstance(db_session, Session):
+        yield db_session
+    else:
+        with db_session() as new_session:
+            yield new_session
+
+
+class PoolMetrics(BaseModel):
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+
+    model_config = ConfigDict(frozen=True)
 
 
 class EventStore:
-    def __init__(self, db_session: Session):
-        self.db_session = db_session
+    def __init__(
+        self,
+        db_session: Session | sessionmaker[Session] | Engine,
+        copy_threshold: int | None = None,
+        payload_format: PayloadFormat = PayloadFormat.Json,
+        dictionaries: PayloadDictionaries | None = None,
+    ):
+        """
+        Events are appended with multi-row INSERTs that bypass the ORM unit of work.
+        Batches of at least `copy_threshold` events are streamed with COPY instead.
+        Their data is stored in `payload_format`; every row records its format,
+        so stores with different formats can share the table.
+        Payloads compressed by `compress_events` are decompressed by the event
+        decoders with `dictionaries`, which the reads fill as they meet new ones.
+
+        Given an engine or a session factory, every operation runs in its own
+        short-lived session with a pooled connection, so the store can be shared
+        by threads and no identity map outlives an operation. A Session is used
+        for every operation and only by one thread at a time.
+        """
+        self.db_session = (
+            sessionmaker(db_session) if isinstance(db_session, Engine) else db_session
+        )
+        self.copy_threshold = copy_threshold
+        self.payload_format = payload_format
+        self.dictionaries = (
+            dictionaries if dictionaries is not None else PayloadDictionaries()
+        )
+
+    @classmethod
+    def from_url(
+        cls,
+        url: str,
+        pool_size: int = 10,
+        max_overflow: int = 10,
+        pool_timeout: float = 30,
+        copy_threshold: int | None = None,
+        payload_format: PayloadFormat = PayloadFormat.Json,
+    ) -> "EventStore":
+        """
+        Creates a store with its own pooled engine: up to `pool_size` connections
+        are kept open and `max_overflow` more are opened under load. Operations
+        wait `pool_timeout` seconds for a connection before failing.
+        SQLite URLs get an engine of `create_sqlite_engine`.
+        """
+        engine = (
+            create_sqlite_engine
+            if make_url(url).get_backend_name() == "sqlite"
+            else create_engine
+        )(
+            url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_pre_ping=True,
+        )
+        return cls(engine, copy_threshold, payload_format)
+
+    def pool_metrics(self) -> PoolMetrics:
+        """
+        Returns how many connections the pool holds and how many are in use.
+        Raises ValueError unless the store runs on an engine with a QueuePool.
+        """
+        bind: Engine | Connection | None
+        if isinstance(self.db_session, Session):
+            bind = self.db_session.get_bind()
+        else:
+            bind = self.db_session.kw.get("bind")
+            if bind is None:
+                # The session class may resolve its bind on its own
+                with self.db_session() as db_session:
+                    try:
+                        bind = db_session.get_bind()
+                    except UnboundExecutionError:
+                        bind = None
+        if not isinstance(bind, (Engine, Connection)):
+            raise ValueError("Pool metrics need a store bound to an engine")
+        pool = bind.engine.pool
+        if not isinstance(pool, QueuePool):
+            raise ValueError(f"{type(pool).__name__} doesn't report its usage")
+        return PoolMetrics(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+
+    def _session(self) -> AbstractContextManager[Session]:
+        return session_scope(self.db_session)
+
+    def append_events(
+        self,
+        stream_name: str,
+        events: list[Event],
+        expected_version: ExpectedStreamVersion = StreamState.Any,
+    ) -> AppendResult:
+        """
+        Appends events at the end of the stream.
+        Raises ExpectedVersionConflictError if the stream is not at `expected_version`:
+        a stream version, `StreamState.NoStream`, `StreamState.StreamExists`
+        or `StreamState.Any` to skip the check.
+        """
+        with self._session() as db_session, db_session.begin():
+            stream_version = self._claim_positions(
+                db_session, stream_name, len(events), expected_version
+            )
+            rows = self._event_rows(stream_name, stream_version, events)
+            log_positions: list[int] = []
+            if (
+                self.copy_threshold is not None
+                and len(rows) >= self.copy_threshold
+                and _dialect_name(db_session) == "postgresql"
+            ):
+                self._copy_rows(db_session, rows)
+                log_positions = self._log_positions(
+                    db_session, stream_name, stream_version
+                )
+            elif rows:
+                log_positions = self._insert_rows(db_session, rows)
+        return AppendResult(
+            event_ids=[row["id"] for row in rows],
+            log_positions=log_positions,
+            next_expected_stream_version=stream_version + len(rows),
+        )
 
-    def append_events(self, stream_name: str, events: list[Event]) -> None:
-        with self.db_session.begin():
+    def read_stream(
+        self,
+        stream_name: str,
+        from_version: int | None = None,
+        max_count: int | None = None,
+        direction: ReadDirection = ReadDirection.Forward,
+    ) -> list[EventStream]:
+        """
+        Returns up to `max_count` events of the stream. Forward reads return the
+        events appended after the stream was at `from_version`, oldest first.
+        Backward reads return the events up to `from_version`, or the head of the
+        stream, newest first: `max_count=3, direction=ReadDirection.Backward`
+        reads its last three events.
+        """
+        with self._session() as db_session, db_session.begin():
+            events = list(
+                db_session.scalars(
+                    _stream_window(
+                        select(EventStream),
+                        stream_name,
+                        from_version,
+                        max_count,
+                        direction,
+                    )
+                )
+            )
+            self._load_dictionaries(
+                db_session, (event.dictionary_id for event in events)
+            )
+            # Detach the rows so they stay readable once the read transaction
+            # ends, leaving other objects of a caller's session attached
             for event in events:
-                self.db_session.add(
-                    EventStream(
-                        stream_name=stream_name,
-                        event_type=event.type,
-                        event_data=event.data.model_dump_json(),
+                db_session.expunge(event)
+        return events
+
+    def read_stream_rows(
+        self,
+        stream_name: str,
+        from_version: int | None = None,
+        max_count: int | None = None,
+        direction: ReadDirection = ReadDirection.Forward,
+    ) -> list[EventRow]:
+        """
+        Returns the type and payload of the events `read_stream` would return,
+        as plain rows that skip the ORM entirely.
+        """
+        with self._session() as db_session, db_session.begin():
+            rows: list[EventRow] = list(
+                db_session.execute(
+                    _stream_window(
+                        select(
+                            EventStream.event_type,
+                            EventStream.payload_format,
+                            EventStream.event_data,
+                            EventStream.event_payload,
+                            EventStream.dictionary_id,
+                        ),
+                        stream_name,
+                        from_version,
+                        max_count,
+                        direction,
+                    )
+                )
+            )
+            self._load_dictionaries(db_session, (event.dictionary_id for event in rows))
+        return rows
+
+    def read_streams(
+        self, stream_names: Iterable[str], chunk_size: int = 1000
+    ) -> dict[str, list[StreamEventRow]]:
+        """
+        Returns the event rows of many streams by stream name, in stream order,
+        with one indexed query per `chunk_size` names instead of one per stream.
+        Unknown streams map to an empty list.
+        """
+        streams: dict[str, list[StreamEventRow]] = {
+            stream_name: [] for stream_name in stream_names
+        }
+        with self._session() as db_session, db_session.begin():
+            for chunk in batched(streams, chunk_size):
+                rows: Iterable[StreamEventRow] = db_session.execute(
+                    select(
+                        EventStream.stream_name,
+                        EventStream.event_type,
+                        EventStream.payload_format,
+                        EventStream.event_data,
+                        EventStream.event_payload,
+                        EventStream.dictionary_id,
                     )
+                    .where(EventStream.stream_name.in_(chunk))
+                    .order_by(EventStream.stream_name, EventStream.stream_position)
+                )
+                # Rows come sorted by stream, so each stream is one run of rows
+                for stream_name, stream_rows in groupby(
+                    rows, attrgetter("stream_name")
+                ):
+                    streams[stream_name] = list(stream_rows)
+                self._load_dictionaries(
+                    db_session,
+                    {
+                        row.dictionary_id
+                        for stream_name in chunk
+                        for row in streams[stream_name]
+                    },
+                )
+        return streams
+
+    def iter_stream(
+        self, stream_name: str, from_version: int = 0, batch_size: int = 500
+    ) -> Iterator[EventStream]:
+        """
+        Yields the events of the stream in order, fetching them from a server-side
+        cursor `batch_size` rows at a time, so memory doesn't grow with the stream.
+        The read transaction stays open until the iterator is exhausted or closed.
+        """
+        with self._session() as db_session, db_session.begin():
+            batches = db_session.scalars(
+                select(EventStream)
+                .where(
+                    EventStream.stream_name == stream_name,
+                    EventStream.stream_position > from_version,
+                )
+                .order_by(EventStream.stream_position)
+                .execution_options(yield_per=batch_size)
+            ).partitions()
+            for batch in batches:
+                self._load_dictionaries(
+                    db_session, (event.dictionary_id for event in batch)
                 )
+                yield from batch
+                # Don't let the identity map collect every row of the stream
+                for event in batch:
+                    db_session.expunge(event)
+
+    def read_all(
+        self, after: LogPosition = LogPosition(), max_count: int = 1000
+    ) -> list[EventStream]:
+        """
+        Returns up to `max_count` events of all streams after `after`, ordered
+        by appending transaction, then log position. Pass `LogPosition.of` the
+        last returned event to get the next page.
+
+        Log positions are taken at INSERT, after the transaction got its id
+        claiming the stream head, so a transaction can commit a lower position
+        than one already committed. On Postgres, only events of transactions
+        older than every transaction still running are returned: a transaction
+        id not yet settled is higher than all returned ones, so its events come
+        after the checkpoint of a consumer. SQLite writers are serialized and
+        record no transaction id, the order is the log position order there.
+        """
+        with self._session() as db_session, db_session.begin():
+            settled = (
+                EventStream.transaction_id
+                < func.pg_snapshot_xmin(func.pg_current_snapshot())
+                .cast(String)
+                .cast(BigInteger)
+                if _dialect_name(db_session) == "postgresql"
+                else true()
+            )
+            events = (
+                db_session.query(EventStream)
+                .filter(
+                    tuple_(EventStream.transaction_id, EventStream.log_position)
+                    > tuple_(
+                        literal(after.transaction_id), literal(after.log_position)
+                    ),
+                    settled,
+                )
+                .order_by(EventStream.transaction_id, EventStream.log_position)
+                .limit(max_count)
+                .all()
+            )
+            self._load_dictionaries(
+                db_session, (event.dictionary_id for event in events)
+            )
+            for event in events:
+                db_session.expunge(event)
+        return events
+
+    def train_dictionary(
+        self, sample_size: int = 1000, dictionary_size: int = 16 * 1024
+    ) -> int:
+        """
+        Trains a zstandard dictionary on up to `sample_size` uncompressed payloads
+        picked at random, stores it and returns its id for `compress_events`.
+
+        On Postgres the payloads come from a TABLESAMPLE of the pages, sized by
+        the planner's row estimate, instead of sorting the whole table randomly.
+        """
+        if zstandard is None:
+            raise ImportError("Payload compression requires the zstandard package")
+        with self._session() as db_session, db_session.begin():
+            if _dialect_name(db_session) == "postgresql":
+                sampled = tablesample(
+                    EventStream.__table__,
+                    self._sample_percent(db_session, sample_size),
+                )
+                query = select(sampled.c.event_data, sampled.c.event_payload).where(
+                    sampled.c.dictionary_id.is_(None)
+                )
+            else:
+                query = (
+                    select(EventStream.event_data, EventStream.event_payload)
+                    .where(EventStream.dictionary_id.is_(None))
+                    .order_by(func.random())
+                )
+            samples: list[bytes | bytearray | memoryview[int]] = [
+                _payload_bytes(event_data, event_payload)
+                for event_data, event_payload in db_session.execute(
+                    query.limit(sample_size)
+                )
+            ]
+            dictionary_data = zstandard.train_dictionary(
+                dictionary_size, samples
+            ).as_bytes()
+            dictionary_id: int = db_session.execute(
+                insert(payload_dictionaries)
+                .values(dictionary_data=dictionary_data)
+                .returning(payload_dictionaries.c.id)
+            ).scalar_one()
+        self.dictionaries.add(dictionary_id, dictionary_data)
+        return dictionary_id
+
+    def compress_events(
+        self, older_than: timedelta, dictionary_id: int, batch_size: int = 1000
+    ) -> int:
+        """
+        Compresses the payloads of events appended more than `older_than` ago
+        with the dictionary, `batch_size` events per transaction, leaving recent
+        events as they are. Returns how many events were compressed.
 
-    def read_stream(self, stream_name: str) -> list[EventStream]:
-        return (
-            self.db_session.query(EventStream)
-            .filter(EventStream.stream_name == stream_name)
-            .all()
+        Walks the log forward on the log position index, page after page, and
+        stops at the first event that isn't old enough yet, so a run reads each
+        cold event once instead of rescanning the table for every batch.
+        """
+        compressed = 0
+        with self._session() as db_session, db_session.begin():
+            appended_before = (
+                db_session.execute(select(func.now())).scalar_one() - older_than
+            )
+        last_position = 0
+        while True:
+            with self._session() as db_session, db_session.begin():
+                self._load_dictionaries(db_session, [dictionary_id])
+                events = db_session.execute(
+                    select(
+                        EventStream.id,
+                        EventStream.log_position,
+                        (EventStream.created_at < appended_before).label("cold"),
+                        EventStream.event_data,
+                        EventStream.event_payload,
+                    )
+                    .where(
+                        EventStream.log_position > last_position,
+                        EventStream.dictionary_id.is_(None),
+                    )
+                    .order_by(EventStream.log_position)
+                    .limit(batch_size)
+                    .with_for_update(skip_locked=True)
+                ).all()
+                cold = list(takewhile(attrgetter("cold"), events))
+                if cold:
+                    # ORM bulk UPDATE by primary key, sent as one executemany
+                    db_session.execute(
+                        update(EventStream),
+                        [
+                            {
+                                "id": event.id,
+                                "event_data": None,
+                                "event_payload": self.dictionaries.compress(
+                                    dictionary_id,
+                                    _payload_bytes(
+                                        event.event_data, event.event_payload
+                                    ),
+                                ),
+                                "dictionary_id": dictionary_id,
+                            }
+                            for event in cold
+                        ],
+                    )
+                    compressed += len(cold)
+                if len(cold) < batch_size:
+                    return compressed
+                last_position = cold[-1].log_position
+
+    def _sample_percent(self, db_session: Session, sample_size: int) -> float:
+        # Four times oversampled, the sampled pages also hold compressed payloads.
+        # Without statistics yet the estimate is 0 and every page is sampled.
+        estimated_rows = db_session.execute(
+            text(
+                "SELECT coalesce(sum(reltuples), 0) FROM pg_class "
+                "WHERE relkind = 'r' AND reltuples > 0 "
+                "AND (oid = CAST(:table_name AS regclass) "
+                "OR oid IN (SELECT relid FROM pg_partition_tree("
+                "CAST(:table_name AS regclass))))"
+            ),
+            {"table_name": EventStream.__tablename__},
+        ).scalar_one()
+        if estimated_rows <= 0:
+            return 100.0
+        return min(100.0, 400.0 * sample_size / float(estimated_rows))
+
+    def stream_version(self, stream_name: str) -> int:
+        with self._session() as db_session, db_session.begin():
+            return self._stream_version(db_session, stream_name)
+
+    def _stream_version(self, db_session: Session, stream_name: str) -> int:
+        stream_position: int | None = db_session.execute(
+            select(stream_heads.c.stream_position).where(
+                stream_heads.c.stream_name == stream_name
+            )
+        ).scalar_one_or_none()
+        return stream_position or 0
+
+    def _load_dictionaries(
+        self, db_session: Session, dictionary_ids: Iterable[int | None]
+    ) -> None:
+        """
+        Fetches the dictionaries that aren't known yet, in the read transaction
+        that returns the events compressed with them.
+        """
+        missing = {
+            dictionary_id
+            for dictionary_id in dictionary_ids
+            if dictionary_id is not None and dictionary_id not in self.dictionaries
+        }
+        if not missing:
+            return
+        for dictionary_id, dictionary_data in db_session.execute(
+            select(
+                payload_dictionaries.c.id, payload_dictionaries.c.dictionary_data
+            ).where(payload_dictionaries.c.id.in_(missing))
+        ):
+            self.dictionaries.add(dictionary_id, dictionary_data)
+
+    def _claim_positions(
+        self,
+        db_session: Session,
+        stream_name: str,
+        count: int,
+        expected_version: ExpectedStreamVersion,
+    ) -> int:
+        """
+        Moves the stream head `count` positions forward if the stream is at the
+        expected version and returns the version the stream had before.
+        """
+        if count == 0:
+            stream_version = self._stream_version(db_session, stream_name)
+            if not _matches(expected_version, stream_version):
+                raise ExpectedVersionConflictError(
+                    stream_name, expected_version, stream_version
+                )
+            return stream_version
+
+        head = stream_heads.c
+        statement: Executable
+        match expected_version:
+            case StreamState.Any:
+                statement = (
+                    upsert(db_session, stream_heads)
+                    .values(stream_name=stream_name, stream_position=count)
+                    .on_conflict_do_update(
+                        index_elements=[head.stream_name],
+                        set_={head.stream_position: head.stream_position + count},
+                    )
+                    .returning(head.stream_position)
+                )
+            case StreamState.NoStream | 0:
+                statement = (
+                    upsert(db_session, stream_heads)
+                    .values(stream_name=stream_name, stream_position=count)
+                    .on_conflict_do_nothing(index_elements=[head.stream_name])
+                    .returning(head.stream_position)
+                )
+            case StreamState.StreamExists:
+                statement = (
+                    update(stream_heads)
+                    .where(head.stream_name == stream_name)
+                    .values(stream_position=head.stream_position + count)
+                    .returning(head.stream_position)
+                )
+            case _:
+                statement = (
+                    update(stream_heads)
+                    .where(
+                        head.stream_name == stream_name,
+                        head.stream_position == expected_version,
+                    )
+                    .values(stream_position=head.stream_position + count)
+                    .returning(head.stream_position)
+                )
+
+        stream_position: int | None = db_session.execute(statement).scalar_one_or_none()
+        if stream_position is None:
+            raise ExpectedVersionConflictError(
+                stream_name,
+                expected_version,
+                self._stream_version(db_session, stream_name),
+            )
+        return stream_position - count
+
+    def _event_rows(
+        self, stream_name: str, stream_version: int, events: list[Event]
+    ) -> list[dict[str, Any]]:
+        payload_column = (
+            "event_payload"
+            if self.payload_format == PayloadFormat.MessagePack
+            else "event_data"
+        )
+        return [
+            {
+                "id": uuid.uuid4(),
+                "stream_name": stream_name,
+                "stream_position": stream_version + index,
+                "event_type": event.type,
+                "payload_format": self.payload_format.value,
+                "event_data": None,
+                "event_payload": None,
+                payload_column: encode_payload(event.data, self.payload_format),
+            }
+            for index, event in enumerate(events, start=1)
+        ]
+
+    def _insert_rows(
+        self, db_session: Session, rows: list[dict[str, Any]]
+    ) -> list[int]:
+        if _dialect_name(db_session) != "postgresql":
+            # No identity column: writers are serialized, the next positions are
+            # free until this transaction ends
+            last_position: int = db_session.execute(
+                select(func.coalesce(func.max(EventStream.log_position), 0))
+            ).scalar_one()
+            for log_position, row in enumerate(rows, start=last_position + 1):
+                row["log_position"] = log_position
+        # With RETURNING, SQLAlchemy sends a bulk INSERT as multi-row
+        # INSERT ... VALUES pages ("insertmanyvalues") on every driver.
+        return list(
+            db_session.scalars(
+                insert(EventStream).returning(
+                    EventStream.log_position, sort_by_parameter_order=True
+                ),
+                rows,
+            )
         )
+
+    def _log_positions(
+        self, db_session: Session, stream_name: str, stream_version: int
+    ) -> list[int]:
+        return list(
+            db_session.scalars(
+                select(EventStream.log_position)
+                .where(
+                    EventStream.stream_name == stream_name,
+                    EventStream.stream_position > stream_version,
+                )
+                .order_by(EventStream.stream_position)
+            )
+        )
+
+    def _copy_rows(self, db_session: Session, rows: list[dict[str, Any]]) -> None:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(
+                (
+                    row["id"],
+                    row["stream_name"],
+                    row["stream_position"],
+                    row["event_type"],
+                    row["payload_format"],
+                    row["event_data"],
+                    # BYTEA hex format, an empty field is NULL
+                    "\\x" + row["event_payload"].hex()
+                    if row["event_payload"] is not None
+                    else None,
+                )
+            )
+        sql = (
+            f"COPY {EventStream.__tablename__} "
+            "(id, stream_name, stream_position, event_type, payload_format, "
+            "event_data, event_payload) "
+            "FROM STDIN WITH (FORMAT csv)"
+        )
+        driver_connection = db_session.connection().connection.driver_connection
+        assert driver_connection is not None
+        cursor = driver_connection.cursor()
+        try:
+            if hasattr(cursor, "copy"):
+                # psycopg 3
+                with cursor.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+            else:
+                # psycopg2
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+        finally:
+            cursor.close()
+
+
+class _PendingAppend(NamedTuple):
+    stream_name: str
+    events: list[Event]
+    expected_version: ExpectedStreamVersion
+    result: Future[AppendResult]
+
+
+class GroupCommitWriter:
+    def __init__(
+        self,
+        event_store: EventStore,
+        max_events: int = 500,
+        max_delay: float = 0.0,
+    ):
+        """
+        Coalesces appends of many threads into shared transactions, so they pay
+        for one commit together instead of one each. A background thread flushes
+        the appends queued while it committed the previous batch, up to
+        `max_events` events. With a `max_delay` it also waits that many seconds
+        after the first append for more to arrive, trading latency for larger
+        batches when commits are expensive.
+
+        Appends are applied in submission order, each with its own expected
+        version check: a conflicting append fails on its own while the others of
+        the batch are committed. Rows of the whole batch go in one multi-row
+        INSERT, COPY isn't used. If the batch transaction fails for any other
+        reason, its appends are retried one by one so only the faulty one fails.
+
+        The store needs an engine or a session factory, the writer thread opens
+        its own sessions.
+        """
+        if isinstance(event_store.db_session, Session):
+            raise ValueError("GroupCommitWriter needs a store with a session factory")
+        self.event_store = event_store
+        self.max_events = max_events
+        self.max_delay = max_delay
+        self._pending: queue.SimpleQueue[_PendingAppend | None] = queue.SimpleQueue()
+        self._closed = False
+        # Makes checking `_closed` and queueing one step, so no append can be
+        # queued behind the sentinel close puts, where it would never be taken
+        self._closing = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="group-commit-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self,
+        stream_name: str,
+        events: list[Event],
+        expected_version: ExpectedStreamVersion = StreamState.Any,
+    ) -> Future[AppendResult]:
+        """
+        Queues the append and returns a future resolved with its result once the
+        batch is committed, or with ExpectedVersionConflictError.
+        From asyncio, await it with `asyncio.wrap_future`. Cancelling the future
+        before the writer takes the append drops it unwritten.
+        """
+        result: Future[AppendResult] = Future()
+        with self._closing:
+            if self._closed:
+                raise RuntimeError("GroupCommitWriter is closed")
+            self._pending.put(
+                _PendingAppend(stream_name, events, expected_version, result)
+            )
+        return result
+
+    def append_events(
+        self,
+        stream_name: str,
+        events: list[Event],
+        expected_version: ExpectedStreamVersion = StreamState.Any,
+    ) -> AppendResult:
+        """
+        Appends events like `EventStore.append_events`, blocking until committed.
+        """
+        return self.submit(stream_name, events, expected_version).result()
+
+    def close(self) -> None:
+        """
+        Flushes the queued appends and stops the writer thread.
+        """
+        with self._closing:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending.put(None)
+        self._thread.join()
+
+    def __enter__(self) -> "GroupCommitWriter":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._pending.get()
+            if first is None:
+                return
+            # Cancelled appends are dropped before they claim any positions;
+            # the others can't be cancelled any more once taken
+            if not first.result.set_running_or_notify_cancel():
+                continue
+            batch = [first]
+            event_count = len(first.events)
+            deadline = time.monotonic() + self.max_delay
+            while event_count < self.max_events:
+                try:
+                    pending = self._pending.get(
+                        timeout=max(deadline - time.monotonic(), 0)
+                    )
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                if pending.result.set_running_or_notify_cancel():
+                    batch.append(pending)
+                    event_count += len(pending.events)
+            try:
+                self._flush(batch)
+            except Exception as error:
+                # Keeps the writer alive, failing what the batch left unresolved
+                for pending in batch:
+                    if not pending.result.done():
+                        pending.result.set_exception(error)
+
+    def _flush(self, batch: list[_PendingAppend]) -> None:
+        try:
+            outcomes = self._append_batch(batch)
+        except Exception:
+            for pending in batch:
+                if pending.result.done():
+                    continue
+                try:
+                    pending.result.set_result(
+                        self.event_store.append_events(
+                            pending.stream_name,
+                            pending.events,
+                            pending.expected_version,
+                        )
+                    )
+                except Exception as error:
+                    pending.result.set_exception(error)
+            return
+        for pending, outcome in zip(batch, outcomes):
+            if pending.result.done():
+                continue
+            if isinstance(outcome, AppendResult):
+                pending.result.set_result(outcome)
+            else:
+                pending.result.set_exception(outcome)
+
+    def _append_batch(
+        self, batch: list[_PendingAppend]
+    ) -> list[AppendResult | ExpectedVersionConflictError]:
+        event_store = self.event_store
+        with event_store._session() as db_session, db_session.begin():
+            claims: list[
+                tuple[int, list[dict[str, Any]]] | ExpectedVersionConflictError
+            ] = []
+            for pending in batch:
+                # A failed claim writes nothing, so the transaction goes on
+                try:
+                    stream_version = event_store._claim_positions(
+                        db_session,
+                        pending.stream_name,
+                        len(pending.events),
+                        pending.expected_version,
+                    )
+                except ExpectedVersionConflictError as error:
+                    claims.append(error)
+                    continue
+                claims.append(
+                    (
+                        stream_version,
+                        event_store._event_rows(
+                            pending.stream_name, stream_version, pending.events
+                        ),
+                    )
+                )
+            rows = [
+                row
+                for claim in claims
+                if not isinstance(claim, ExpectedVersionConflictError)
+                for row in claim[1]
+            ]
+            log_positions = event_store._insert_rows(db_session, rows) if rows else []
+
+        outcomes: list[AppendResult | ExpectedVersionConflictError] = []
+        offset = 0
+        for claim in claims:
+            if isinstance(claim, ExpectedVersionConflictError):
+                outcomes.append(claim)
+                continue
+            stream_version, claimed_rows = claim
+            outcomes.append(
+                AppendResult(
+                    event_ids=[row["id"] for row in claimed_rows],
+                    log_positions=log_positions[offset : offset + len(claimed_rows)],
+                    next_expected_stream_version=stream_version + len(claimed_rows),
+                )
+            )
+            offset += len(claimed_rows)
+        return outcomes
+
+
+class AsyncEventStore:
+    def __init__(self, db_session: AsyncSession | async_sessionmaker[AsyncSession]):
+        """
+        Asyncio counterpart of EventStore, for engines on an async driver
+        (`postgresql+psycopg`, `postgresql+asyncpg`).
+        Operations share one session when given an AsyncSession. Given a session
+        factory, each operation checks out its own session, so one event loop can
+        keep as many of them in flight as the engine pool has connections.
+        """
+        self.db_session = db_session
+        self.dictionaries = PayloadDictionaries()
+
+    async def append_events(
+        self,
+        stream_name: str,
+        events: list[Event],
+        expected_version: ExpectedStreamVersion = StreamState.Any,
+    ) -> AppendResult:
+        """
+        Appends events at the end of the stream, see `EventStore.append_events`.
+        """
+        return await self._run(
+            lambda event_store: event_store.append_events(
+                stream_name, events, expected_version
+            )
+        )
+
+    async def read_stream(
+        self,
+        stream_name: str,
+        from_version: int | None = None,
+        max_count: int | None = None,
+        direction: ReadDirection = ReadDirection.Forward,
+    ) -> list[EventStream]:
+        return await self._run(
+            lambda event_store: event_store.read_stream(
+                stream_name, from_version, max_count, direction
+            )
+        )
+
+    async def stream_version(self, stream_name: str) -> int:
+        return await self._run(
+            lambda event_store: event_store.stream_version(stream_name)
+        )
+
+    async def _run[T](self, operation: Callable[[EventStore], T]) -> T:
+        # AsyncSession runs the sync session in a greenlet that suspends on every
+        # database round trip, so EventStore's statements are shared as they are.
+        # COPY is left out: it would need the driver's own async API.
+        if isinstance(self.db_session, AsyncSession):
+            return await self.db_session.run_sync(
+                lambda db_session: operation(
+                    EventStore(db_session, dictionaries=self.dictionaries)
+                )
+            )
+        async with self.db_session() as db_session:
+            return await db_session.run_sync(
+                lambda db_session: operation(
+                    EventStore(db_session, dictionaries=self.dictionaries)
+                )
+            )
+
+
+def _stream_window[S: Select[Any]](
+    statement: S,
+    stream_name: str,
+    from_version: int | None,
+    max_count: int | None,
+    direction: ReadDirection,
+) -> S:
+    # Both directions are range scans of the (stream_name, stream_position) index
+    position = EventStream.stream_position
+    statement = statement.where(EventStream.stream_name == stream_name)
+    if direction == ReadDirection.Forward:
+        statement = statement.where(position > (from_version or 0)).order_by(position)
+    else:
+        if from_version is not None:
+            statement = statement.where(position <= from_version)
+        statement = statement.order_by(position.desc())
+    if max_count is not None:
+        statement = statement.limit(max_count)
+    return statement
+
+
+def _payload_bytes(event_data: str | None, event_payload: bytes | None) -> bytes:
+    return event_payload if event_payload is not None else str(event_data).encode()
+
+
+def _matches(expected_version: ExpectedStreamVersion, stream_version: int) -> bool:
+    match expected_version:
+        case StreamState.Any:
+            return True
+        case StreamState.NoStream:
+            return stream_version == 0
+        case StreamState.StreamExists:
+            return stream_version > 0
+        case _:
+            return stream_version == expected_version
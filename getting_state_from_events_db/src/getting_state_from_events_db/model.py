@@ -1,9 +1,21 @@
 import uuid
 from datetime import datetime
-from typing import ClassVar
+from decimal import Decimal
+from enum import StrEnum
+from typing import Any, ClassVar, Iterable, cast
 from pydantic import BaseModel, ConfigDict
+from pydantic_core import from_json
 from sqlalchemy import func
 
+try:
+    import msgpack
+except ImportError:  # Only needed for PayloadFormat.MessagePack
+    msgpack = None
+try:
+    import zstandard
+except ImportError:  # Only needed for compressed payloads
+    zstandard = None  # type: ignore[assignment]
+
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -21,3 +33,154 @@ class Event(BaseModel):
     data: BaseModel
 
     model_config = ConfigDict(frozen=True)
+
+
+class PayloadFormat(StrEnum):
+    # JSON text in the JSONB `event_data` column
+    Json = "json"
+    # MessagePack bytes in the BYTEA `event_payload` column, Decimals kept exact
+    MessagePack = "msgpack"
+
+
+_DECIMAL_EXT_TYPE = 1
+
+
+def encode_payload(data: BaseModel, payload_format: PayloadFormat) -> str | bytes:
+    if payload_format == PayloadFormat.Json:
+        return data.model_dump_json()
+    if msgpack is None:
+        raise ImportError("PayloadFormat.MessagePack requires the msgpack package")
+    return bytes(
+        msgpack.packb(data.model_dump(), default=_encode_msgpack_value, datetime=True)
+    )
+
+
+def _encode_msgpack_value(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(_DECIMAL_EXT_TYPE, str(value).encode())
+    if isinstance(value, datetime):
+        # Aware datetimes are packed as timestamps, naive ones fall back to ISO text
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} as MessagePack")
+
+
+def _decode_msgpack_value(code: int, data: bytes) -> Any:
+    if code == _DECIMAL_EXT_TYPE:
+        return Decimal(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+class PayloadDictionaries:
+    """
+    Zstandard dictionaries by id, used to compress payloads and to decompress
+    the rows compressed with them. Pickles as the raw dictionaries, so they can
+    be sent to worker processes.
+    """
+
+    def __init__(self) -> None:
+        self._dictionary_data: dict[int, bytes] = {}
+        self._compressors: dict[int, zstandard.ZstdCompressor] = {}
+        self._decompressors: dict[int, zstandard.ZstdDecompressor] = {}
+
+    def __getstate__(self) -> dict[int, bytes]:
+        return self._dictionary_data
+
+    def __setstate__(self, dictionary_data: dict[int, bytes]) -> None:
+        self._dictionary_data, self._compressors, self._decompressors = {}, {}, {}
+        for dictionary_id, data in dictionary_data.items():
+            self.add(dictionary_id, data)
+
+    def __contains__(self, dictionary_id: int) -> bool:
+        return dictionary_id in self._decompressors
+
+    def add(self, dictionary_id: int, dictionary_data: bytes) -> None:
+        if zstandard is None:
+            raise ImportError("Payload compression requires the zstandard package")
+        dictionary = zstandard.ZstdCompressionDict(dictionary_data)
+        self._dictionary_data[dictionary_id] = dictionary_data
+        self._compressors[dictionary_id] = zstandard.ZstdCompressor(
+            dict_data=dictionary
+        )
+        self._decompressors[dictionary_id] = zstandard.ZstdDecompressor(
+            dict_data=dictionary
+        )
+
+    def compress(self, dictionary_id: int, payload: bytes) -> bytes:
+        return self._compressors[dictionary_id].compress(payload)
+
+    def decompress(self, dictionary_id: int, payload: bytes) -> bytes:
+        return self._decompressors[dictionary_id].decompress(payload)
+
+
+class EventCodec:
+    """
+    Decodes stored events of the registered event types.
+    Each row is validated once by its event model, payload included, instead of
+    validating the payload first and wrapping it into the event afterwards.
+    MessagePack payloads are unpacked straight from their bytes, compressed
+    payloads are decompressed with the dictionary they were compressed with.
+    """
+
+    def __init__(self, *event_types: type[Event]):
+        self.event_types: dict[str, type[Event]] = {}
+        self.register(*event_types)
+
+    def register(self, *event_types: type[Event]) -> None:
+        for event_type in event_types:
+            self.event_types[event_type.type] = event_type
+
+    def decode(
+        self,
+        rows: Iterable[tuple[str, str, str | bytes, int | None]],
+        dictionaries: PayloadDictionaries | None = None,
+    ) -> list[Event]:
+        """
+        Decodes (event_type, payload_format, payload, dictionary_id) rows,
+        keeping their order.
+        """
+        events = []
+        for event_type, payload_format, payload, dictionary_id in rows:
+            event_class = self.event_types.get(event_type)
+            if event_class is None:
+                raise ValueError(f"Unregistered event type: {event_type}")
+            if dictionary_id is not None:
+                payload = _decompress(payload, dictionary_id, dictionaries)
+            if payload_format == PayloadFormat.MessagePack:
+                events.append(
+                    event_class.model_validate({"data": _unpack_msgpack(payload)})
+                )
+            elif isinstance(payload, bytes):
+                events.append(event_class.model_validate_json(b'{"data":%s}' % payload))
+            else:
+                events.append(event_class.model_validate_json(f'{{"data":{payload}}}'))
+        return events
+
+
+def decode_payload(
+    payload_format: str,
+    payload: str | bytes,
+    dictionary_id: int | None = None,
+    dictionaries: PayloadDictionaries | None = None,
+) -> Any:
+    """
+    Parses a stored payload into plain data without validating it. JSON gives
+    strings and numbers, e.g. Decimals and datetimes as text; MessagePack gives
+    them back as Decimals and datetimes.
+    """
+    if dictionary_id is not None:
+        payload = _decompress(payload, dictionary_id, dictionaries)
+    if payload_format == PayloadFormat.MessagePack:
+        return _unpack_msgpack(payload)
+    return from_json(payload)
+
+
+def _decompress(
+    payload: str | bytes, dictionary_id: int, dictionaries: PayloadDictionaries | None
+) -> bytes:
+    if dictionaries is None:
+        raise ValueError("Compressed payloads need their dictionaries")
+    return dictionaries.decompress(dictionary_id, cast(bytes, payload))
+
+
+def _unpack_msgpack(payload: str | bytes) -> Any:
+    return msgpack.unpackb(payload, ext_hook=_decode_msgpack_value, timestamp=3)
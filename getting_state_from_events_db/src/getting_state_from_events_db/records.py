@@ -0,0 +1,101 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import NamedTuple
+
+
+# Compact tuple-backed events for folding, a fraction of the size of the
+# pydantic events. Prices are fixed-point: an integer coefficient and a power
+# of ten exponent, see `to_fixed_point`.
+
+
+class ShoppingCartOpenedRecord(NamedTuple):
+    shopping_cart_id: str
+    client_id: str
+    opened_at: datetime
+
+
+class ProductItemAddedRecord(NamedTuple):
+    product_id: str
+    quantity: int
+    price_coefficient: int
+    price_exponent: int
+
+
+class ProductItemRemovedRecord(NamedTuple):
+    product_id: str
+    quantity: int
+    price_coefficient: int
+    price_exponent: int
+
+
+class ShoppingCartConfirmedRecord(NamedTuple):
+    confirmed_at: datetime
+
+
+class ShoppingCartCanceledRecord(NamedTuple):
+    canceled_at: datetime
+
+
+type ShoppingCartRecord = (
+    ShoppingCartOpenedRecord
+    | ProductItemAddedRecord
+    | ProductItemRemovedRecord
+    | ShoppingCartConfirmedRecord
+    | ShoppingCartCanceledRecord
+)
+
+
+def to_fixed_point(value: Decimal) -> tuple[int, int]:
+    """
+    Splits a decimal into its coefficient and exponent, keeping the digits as
+    written: 2.5 is (25, -1) and 2.50 is (250, -2). Negative zero reads as zero.
+    """
+    sign, digits, exponent = value.as_tuple()
+    if not isinstance(exponent, int):
+        raise ValueError(f"Not a finite price: {value}")
+    coefficient = 0
+    for digit in digits:
+        coefficient = coefficient * 10 + digit
+    return -coefficient if sign else coefficient, exponent
+
+
+def parse_fixed_point(value: str | int | float | Decimal) -> tuple[int, int]:
+    """
+    Reads a price as a payload holds it, without building a Decimal for plain
+    decimal text such as "9.99", the way prices are dumped to JSON.
+    """
+    if isinstance(value, str):
+        whole, _, fraction = value.partition(".")
+        try:
+            return int(whole + fraction), -len(fraction)
+        except ValueError:  # Exponent notation, or not a number at all
+            return to_fixed_point(Decimal(value))
+    if isinstance(value, int):
+        return value, 0
+    if isinstance(value, float):
+        return to_fixed_point(Decimal(repr(value)))
+    return to_fixed_point(value)
+
+
+def from_fixed_point(coefficient: int, exponent: int) -> Decimal:
+    # Built from the digits, so no context precision or rounding applies
+    return Decimal(
+        (
+            int(coefficient < 0),
+            tuple(int(digit) for digit in str(abs(coefficient))),
+            exponent,
+        )
+    )
+
+
+def normalize_fixed_point(coefficient: int, exponent: int) -> tuple[int, int]:
+    """
+    Strips trailing zeros, so fixed-point numbers of equal value, such as 2.5
+    and 2.50, normalize to the same pair.
+    """
+    if coefficient == 0:
+        return 0, 0
+    while coefficient % 10 == 0:
+        coefficient //= 10
+        exponent += 1
+    return coefficient, exponent
@@ -0,0 +1,93 @@
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import BigInteger, Column, DateTime, String, Table, func, select
+from sqlalchemy.orm import Session, sessionmaker
+from .event_store import JSONBText, session_scope, upsert
+from .model import Base
+
+
+snapshots = Table(
+    "snapshots",
+    Base.metadata,
+    Column("stream_name", String, primary_key=True),
+    Column("stream_version", BigInteger, primary_key=True),
+    Column("state", JSONBText, nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+class SnapshotPolicy(BaseModel):
+    """
+    Tells when the state of a stream is worth a new snapshot: once `every_events`
+    events were appended since the last one, or once folding the events after it
+    took at least `fold_time_threshold` seconds.
+    """
+
+    every_events: int | None = 100
+    fold_time_threshold: float | None = None
+
+    model_config = ConfigDict(frozen=True)
+
+    def should_snapshot(self, events_since_snapshot: int, fold_time: float) -> bool:
+        if events_since_snapshot == 0:
+            return False
+        return (
+            self.every_events is not None and events_since_snapshot >= self.every_events
+        ) or (
+            self.fold_time_threshold is not None
+            and fold_time >= self.fold_time_threshold
+        )
+
+
+class SnapshotStore[S: BaseModel]:
+    """
+    Keeps snapshots of a stream state so it can be rebuilt from the latest one
+    and the events appended after it, instead of the whole stream.
+    """
+
+    def __init__(
+        self,
+        db_session: Session | sessionmaker[Session],
+        state_type: type[S],
+        policy: SnapshotPolicy = SnapshotPolicy(),
+    ):
+        self.db_session = db_session
+        self.state_type = state_type
+        self.policy = policy
+
+    def load(self, stream_name: str) -> tuple[S, int] | None:
+        """
+        Returns the latest snapshot of the stream with the version it was taken at.
+        """
+        with session_scope(self.db_session) as db_session, db_session.begin():
+            snapshot = db_session.execute(
+                select(snapshots.c.state, snapshots.c.stream_version)
+                .where(snapshots.c.stream_name == stream_name)
+                .order_by(snapshots.c.stream_version.desc())
+                .limit(1)
+            ).one_or_none()
+        if snapshot is None:
+            return None
+        return self.state_type.model_validate_json(
+            snapshot.state
+        ), snapshot.stream_version
+
+    def latest_version(self, stream_name: str) -> int:
+        with session_scope(self.db_session) as db_session, db_session.begin():
+            stream_version: int | None = db_session.execute(
+                select(func.max(snapshots.c.stream_version)).where(
+                    snapshots.c.stream_name == stream_name
+                )
+            ).scalar_one()
+        return stream_version or 0
+
+    def store(self, stream_name: str, stream_version: int, state: S) -> None:
+        with session_scope(self.db_session) as db_session, db_session.begin():
+            db_session.execute(
+                upsert(db_session, snapshots)
+                .values(
+                    stream_name=stream_name,
+                    stream_version=stream_version,
+                    state=state.model_dump_json(),
+                )
+                .on_conflict_do_nothing()
+            )
@@ -5,14 +5,22 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 from testcontainers.postgres import PostgresContainer  # type: ignore
 
-from appending_events_db.src.appending_events_db.event_store import EventStore
-from appending_events_db.src.appending_events_db.model import Base
-
-postgres = PostgresContainer("postgres:17-alpine")
+from getting_state_from_events_db.src.getting_state_from_events_db.event_store import (
+    EventStore,
+    create_sqlite_engine,
+)
+from getting_state_from_events_db.src.getting_state_from_events_db.model import Base
 
 
 @pytest.fixture(scope="session", autouse=True)
-def setup(request: pytest.FixtureRequest) -> str:
+def setup(
+    request: pytest.FixtureRequest, tmp_path_factory: pytest.TempPathFactory
+) -> str:
+    # DB_BACKEND=sqlite runs the tests in-process, without a container
+    if os.environ.get("DB_BACKEND") == "sqlite":
+        return f"sqlite:///{tmp_path_factory.mktemp('db') / 'events.db'}"
+
+    postgres = PostgresContainer("postgres:17-alpine")
     postgres.start()
 
     def remove_container() -> None:
@@ -30,7 +38,11 @@ def setup(request: pytest.FixtureRequest) -> str:
 
 @pytest.fixture(scope="session")
 def db_session(setup: str) -> Generator[Session, None, None]:
-    engine = create_engine(setup)
+    engine = (
+        create_sqlite_engine(setup)
+        if setup.startswith("sqlite")
+        else create_engine(setup)
+    )
     Base.metadata.create_all(engine)
     with Session(engine) as session:
         yield session
@@ -1,5 +1,8 @@
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal
 from uuid import uuid4 as uuid
+import pytest
+from sqlalchemy.orm import Session
 from datetime import datetime, UTC
 
 
@@ -11,14 +14,30 @@ from getting_state_from_events_db.src.getting_state_from_events_db import (
     ShoppingCartEvent,
     ShoppingCartOpened,
     ProductItemAddedToShoppingCart,
+    ShoppingCart,
     ShoppingCartStatus,
     append_to_stream,
+    decode_events,
+    evolve,
+    get_shopping_cart,
+    get_shopping_cart_from_records,
+    get_shopping_cart_from_rows,
+    get_shopping_carts,
+    iter_stream,
     read_stream,
     get_shopping_cart_from_events,
+    to_record,
 )
 from getting_state_from_events_db.src.getting_state_from_events_db.event_store import (
     EventStore,
 )
+from getting_state_from_events_db.src.getting_state_from_events_db.model import (
+    PayloadFormat,
+)
+from getting_state_from_events_db.src.getting_state_from_events_db.snapshots import (
+    SnapshotPolicy,
+    SnapshotStore,
+)
 
 
 def test_getting_state_from_events_db(event_store: EventStore) -> None:
@@ -87,3 +106,263 @@ def test_getting_state_from_events_db(event_store: EventStore) -> None:
     assert shopping_cart.opened_at == current_time
     assert shopping_cart.confirmed_at == confirmed_at
     assert shopping_cart.canceled_at == canceled_at
+
+
+def test_getting_state_from_lazily_read_events(event_store: EventStore) -> None:
+    """
+    Test that folding over streamed events gives the same state as a full read.
+    """
+    shopping_cart_id = str(uuid())
+    events: list[ShoppingCartEvent] = [
+        ShoppingCartOpened(
+            data=ShoppingCartOpened.Data(
+                shopping_cart_id=shopping_cart_id,
+                client_id=str(uuid()),
+                opened_at=datetime.now(UTC),
+            )
+        ),
+        *[
+            ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    product_item=PricedProductItem(
+                        product_id=str(uuid()), quantity=1, unit_price=Decimal("2.5")
+                    ),
+                )
+            )
+            for _ in range(4)
+        ],
+    ]
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+    append_to_stream(event_store, stream_name, events)
+
+    assert list(decode_events(event_store.iter_stream(stream_name, batch_size=2))) == (
+        events
+    )
+    assert get_shopping_cart_from_events(
+        iter_stream(event_store, stream_name)
+    ) == get_shopping_cart_from_events(read_stream(event_store, stream_name))
+
+
+def test_getting_state_from_snapshot_and_tail(event_store: EventStore) -> None:
+    """
+    Test that snapshots are taken by the policy and the cart is rebuilt from them.
+    """
+    snapshot_store = SnapshotStore(
+        event_store.db_session, ShoppingCart, SnapshotPolicy(every_events=3)
+    )
+    shopping_cart_id = str(uuid())
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+    t_shirt = PricedProductItem(
+        product_id=str(uuid()), quantity=1, unit_price=Decimal("5.0")
+    )
+    added_t_shirt = ProductItemAddedToShoppingCart(
+        data=ProductItemAddedToShoppingCart.Data(
+            shopping_cart_id=shopping_cart_id, product_item=t_shirt
+        )
+    )
+    opened = ShoppingCartOpened(
+        data=ShoppingCartOpened.Data(
+            shopping_cart_id=shopping_cart_id,
+            client_id=str(uuid()),
+            opened_at=datetime.now(UTC),
+        )
+    )
+
+    append_to_stream(event_store, stream_name, [opened, added_t_shirt], snapshot_store)
+    assert snapshot_store.load(stream_name) is None
+
+    append_to_stream(event_store, stream_name, [added_t_shirt], snapshot_store)
+    snapshot = snapshot_store.load(stream_name)
+    assert snapshot is not None
+    assert snapshot[1] == 3
+    assert snapshot[0].product_items == [t_shirt.model_copy(update={"quantity": 2})]
+
+    append_to_stream(event_store, stream_name, [added_t_shirt], snapshot_store)
+    shopping_cart, stream_version = get_shopping_cart(
+        event_store, snapshot_store, stream_name
+    )
+    assert stream_version == 4
+    assert snapshot_store.latest_version(stream_name) == 3
+    assert shopping_cart == get_shopping_cart_from_events(
+        read_stream(event_store, stream_name)
+    )
+
+
+def test_getting_state_of_many_carts_at_once(event_store: EventStore) -> None:
+    """
+    Test that carts rebuilt in a batch match the ones rebuilt one by one.
+    """
+    stream_names = []
+    for product_count in range(3):
+        shopping_cart_id = str(uuid())
+        stream_name = f"shopping_cart_{shopping_cart_id}"
+        append_to_stream(
+            event_store,
+            stream_name,
+            [
+                ShoppingCartOpened(
+                    data=ShoppingCartOpened.Data(
+                        shopping_cart_id=shopping_cart_id,
+                        client_id=str(uuid()),
+                        opened_at=datetime.now(UTC),
+                    )
+                ),
+                *[
+                    ProductItemAddedToShoppingCart(
+                        data=ProductItemAddedToShoppingCart.Data(
+                            shopping_cart_id=shopping_cart_id,
+                            product_item=PricedProductItem(
+                                product_id=str(uuid()),
+                                quantity=1,
+                                unit_price=Decimal("2.5"),
+                            ),
+                        )
+                    )
+                    for _ in range(product_count)
+                ],
+            ],
+        )
+        stream_names.append(stream_name)
+    unknown_stream_name = f"shopping_cart_{uuid()}"
+
+    expected = {
+        stream_name: get_shopping_cart_from_events(
+            read_stream(event_store, stream_name)
+        )
+        for stream_name in [*stream_names, unknown_stream_name]
+    }
+    assert expected[unknown_stream_name] == ShoppingCart()
+    assert (
+        get_shopping_carts(
+            event_store, [*stream_names, unknown_stream_name], chunk_size=2
+        )
+        == expected
+    )
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        assert (
+            get_shopping_carts(
+                event_store,
+                [*stream_names, unknown_stream_name],
+                executor,
+                chunk_size=2,
+            )
+            == expected
+        )
+
+
+def test_getting_state_from_compact_records() -> None:
+    """
+    Test that folding compact records gives the state evolve gives.
+    """
+    shopping_cart_id = str(uuid())
+    shoes_id, t_shirt_id = str(uuid()), str(uuid())
+
+    def item(product_id: str, quantity: int, unit_price: str) -> PricedProductItem:
+        return PricedProductItem(
+            product_id=product_id, quantity=quantity, unit_price=Decimal(unit_price)
+        )
+
+    events: list[ShoppingCartEvent] = [
+        ShoppingCartOpened(
+            data=ShoppingCartOpened.Data(
+                shopping_cart_id=shopping_cart_id,
+                client_id=str(uuid()),
+                opened_at=datetime.now(UTC),
+            )
+        ),
+        *[
+            ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id, product_item=product_item
+                )
+            )
+            for product_item in [
+                item(shoes_id, 2, "100"),
+                item(t_shirt_id, 3, "2.5"),
+                item(t_shirt_id, 1, "2.50"),
+                item(shoes_id, 1, "-1E+2"),
+            ]
+        ],
+        ProductItemRemovedFromShoppingCart(
+            data=ProductItemRemovedFromShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id,
+                product_item=item(t_shirt_id, 1, "2.500"),
+            )
+        ),
+        ShoppingCartCanceled(
+            data=ShoppingCartCanceled.Data(
+                shopping_cart_id=shopping_cart_id, canceled_at=datetime.now(UTC)
+            )
+        ),
+    ]
+
+    expected = ShoppingCart()
+    for event in events:
+        expected = evolve(event, expected)
+    shopping_cart = get_shopping_cart_from_records(to_record(event) for event in events)
+
+    assert shopping_cart == expected
+    assert [
+        (item.product_id, item.quantity, str(item.unit_price))
+        for item in shopping_cart.product_items
+    ] == [(shoes_id, 2, "100"), (t_shirt_id, 2, "2.5"), (shoes_id, 1, "-1E+2")]
+
+
+def test_getting_state_from_stored_rows(
+    db_session: Session, event_store: EventStore
+) -> None:
+    """
+    Test that the trusted fold of stored rows gives the state of the strict one.
+    """
+    pytest.importorskip("msgpack")
+    shopping_cart_id = str(uuid())
+    shoes_id = str(uuid())
+
+    def item(quantity: int, unit_price: str) -> PricedProductItem:
+        return PricedProductItem(
+            product_id=shoes_id, quantity=quantity, unit_price=Decimal(unit_price)
+        )
+
+    events: list[ShoppingCartEvent] = [
+        ShoppingCartOpened(
+            data=ShoppingCartOpened.Data(
+                shopping_cart_id=shopping_cart_id,
+                client_id=str(uuid()),
+                opened_at=datetime.now(UTC),
+            )
+        ),
+        ProductItemAddedToShoppingCart(
+            data=ProductItemAddedToShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id, product_item=item(3, "2.50")
+            )
+        ),
+        ProductItemAddedToShoppingCart(
+            data=ProductItemAddedToShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id, product_item=item(1, "1E+1")
+            )
+        ),
+        ProductItemRemovedFromShoppingCart(
+            data=ProductItemRemovedFromShoppingCart.Data(
+                shopping_cart_id=shopping_cart_id, product_item=item(1, "2.5")
+            )
+        ),
+        ShoppingCartConfirmed(
+            data=ShoppingCartConfirmed.Data(
+                shopping_cart_id=shopping_cart_id, confirmed_at=datetime.now(UTC)
+            )
+        ),
+    ]
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+    msgpack_store = EventStore(db_session, payload_format=PayloadFormat.MessagePack)
+    append_to_stream(event_store, stream_name, events[:2])
+    append_to_stream(msgpack_store, stream_name, events[2:])
+
+    expected = ShoppingCart()
+    for event in events:
+        expected = evolve(event, expected)
+    rows = event_store.read_stream_rows(stream_name)
+
+    assert get_shopping_cart_from_rows(rows) == expected
+    assert get_shopping_cart_from_rows(rows, strict=True) == expected
+    assert get_shopping_carts(event_store, [stream_name]) == {stream_name: expected}
@@ -1,2 +1,322 @@
-def main() -> None:
-    print("Hello from optimistic-concurrency-db!")
+from decimal import Decimal
+from typing import Literal, ClassVar
+from pydantic import BaseModel, ConfigDict
+from datetime import datetime
+from enum import StrEnum
+
+from .event_store import (
+    AppendResult,
+    EventRow,
+    EventStore,
+    EventStream,
+    ExpectedStreamVersion,
+    ExpectedVersionConflictError,
+    StreamState,
+)
+from .model import Event, EventCodec, PayloadDictionaries
+from .state_cache import StateCache
+from itertools import batched
+from typing import Iterable, Iterator
+
+
+class ShoppingCartStatus(StrEnum):
+    Pending = "Pending"
+    Confirmed = "Confirmed"
+    Canceled = "Canceled"
+
+
+class ProductItem(BaseModel):
+    product_id: str
+    quantity: int
+
+
+class PricedProductItem(ProductItem):
+    unit_price: Decimal
+
+
+class ShoppingCartOpened(Event):
+    type: ClassVar[Literal["ShoppingCartOpened"]] = "ShoppingCartOpened"
+
+    class Data(BaseModel):
+        shopping_cart_id: str
+        client_id: str
+        opened_at: datetime
+
+    data: Data
+
+
+class ProductItemAddedToShoppingCart(Event):
+    type: ClassVar[Literal["ProductItemAddedToShoppingCart"]] = (
+        "ProductItemAddedToShoppingCart"
+    )
+
+    class Data(BaseModel):
+        shopping_cart_id: str
+        product_item: PricedProductItem
+
+    data: Data
+
+
+class ProductItemRemovedFromShoppingCart(Event):
+    type: ClassVar[Literal["ProductItemRemovedFromShoppingCart"]] = (
+        "ProductItemRemovedFromShoppingCart"
+    )
+
+    class Data(BaseModel):
+        shopping_cart_id: str
+        product_item: PricedProductItem
+
+    data: Data
+
+
+class ShoppingCartConfirmed(Event):
+    type: ClassVar[Literal["ShoppingCartConfirmed"]] = "ShoppingCartConfirmed"
+
+    class Data(BaseModel):
+        shopping_cart_id: str
+        confirmed_at: datetime
+
+    data: Data
+
+
+class ShoppingCartCanceled(Event):
+    type: ClassVar[Literal["ShoppingCartCanceled"]] = "ShoppingCartCanceled"
+
+    class Data(BaseModel):
+        shopping_cart_id: str
+        canceled_at: datetime
+
+    data: Data
+
+
+type ShoppingCartEvent = (
+    ShoppingCartOpened
+    | ProductItemAddedToShoppingCart
+    | ProductItemRemovedFromShoppingCart
+    | ShoppingCartConfirmed
+    | ShoppingCartCanceled
+    | Event
+)
+
+
+class ShoppingCart(BaseModel):
+    id: str | None = None
+    client_id: str | None = None
+    status: ShoppingCartStatus = ShoppingCartStatus.Pending
+    product_items: list[PricedProductItem] = []
+    opened_at: datetime | None = None
+    confirmed_at: datetime | None = None
+    canceled_at: datetime | None = None
+
+    model_config = ConfigDict(frozen=True)
+
+
+def apply_shopping_cart_opened(
+    event: ShoppingCartOpened, _: ShoppingCart
+) -> ShoppingCart:
+    return ShoppingCart(
+        id=event.data.shopping_cart_id,
+        client_id=event.data.client_id,
+        status=ShoppingCartStatus.Pending,
+        product_items=[],
+        opened_at=event.data.opened_at,
+    )
+
+
+def apply_product_item_added(
+    event: ProductItemAddedToShoppingCart, state: ShoppingCart
+) -> ShoppingCart:
+    """
+    Handles the ProductItemAddedToShoppingCart event.
+    """
+    # Add the new product item
+    product_items = list(state.product_items)
+    product_items.append(event.data.product_item)
+
+    # Group items by productId and unitPrice
+    grouped_items: dict[str, list[PricedProductItem]] = {}
+    for item in product_items:
+        key = f"{item.product_id}_{item.unit_price}"
+        if key not in grouped_items:
+            grouped_items[key] = []
+        grouped_items[key].append(item)
+
+    # Transform groups into final format
+    processed_items = [
+        PricedProductItem(
+            product_id=items[0].product_id,
+            quantity=sum(item.quantity for item in items),
+            unit_price=items[0].unit_price,
+        )
+        for items in grouped_items.values()
+    ]
+
+    # Return new state with updated product items, excluding product_items from the dump
+    state_dict = state.model_dump(exclude={"product_items"})
+    return ShoppingCart(**state_dict, product_items=processed_items)
+
+
+def apply_product_item_removed(
+    event: ProductItemRemovedFromShoppingCart, state: ShoppingCart
+) -> ShoppingCart:
+    """
+    Handles removing items by product ID and unit price, updating quantities appropriately.
+    """
+    # Find matching item and update quantity
+    updated_items = []
+    removed_item = event.data.product_item
+
+    for item in state.product_items:
+        if (
+            item.product_id == removed_item.product_id
+            and item.unit_price == removed_item.unit_price
+        ):
+            new_quantity = item.quantity - removed_item.quantity
+            if new_quantity > 0:
+                updated_items.append(
+                    PricedProductItem(
+                        product_id=item.product_id,
+                        quantity=new_quantity,
+                        unit_price=item.unit_price,
+                    )
+                )
+        else:
+            updated_items.append(item)
+
+    return ShoppingCart(
+        **state.model_dump(exclude={"product_items"}), product_items=updated_items
+    )
+
+
+def apply_shopping_cart_confirmed(
+    event: ShoppingCartConfirmed, state: ShoppingCart
+) -> ShoppingCart:
+    return ShoppingCart(
+        **state.model_dump(exclude={"confirmed_at"}),
+        confirmed_at=event.data.confirmed_at,
+    )
+
+
+def apply_shopping_cart_canceled(
+    event: ShoppingCartCanceled, state: ShoppingCart
+) -> ShoppingCart:
+    return ShoppingCart(
+        **state.model_dump(exclude={"canceled_at"}), canceled_at=event.data.canceled_at
+    )
+
+
+def evolve(event: Event, state: ShoppingCart) -> ShoppingCart:
+    match event:
+        case ShoppingCartOpened():
+            return apply_shopping_cart_opened(event, state)
+        case ProductItemAddedToShoppingCart():
+            return apply_product_item_added(event, state)
+        case ProductItemRemovedFromShoppingCart():
+            return apply_product_item_removed(event, state)
+        case ShoppingCartConfirmed():
+            return apply_shopping_cart_confirmed(event, state)
+        case ShoppingCartCanceled():
+            return apply_shopping_cart_canceled(event, state)
+        case _:
+            raise ValueError(f"Unhandled event type: {event.type}")
+
+
+def get_shopping_cart_from_events(
+    events: Iterable[ShoppingCartEvent],
+) -> ShoppingCart:
+    state = ShoppingCart()
+    for event in events:
+        state = evolve(event, state)
+    return state
+
+
+def append_to_stream(
+    event_store: EventStore,
+    stream_name: str,
+    events: list[ShoppingCartEvent],
+    expected_version: ExpectedStreamVersion = StreamState.Any,
+    cache: StateCache[ShoppingCart] | None = None,
+) -> AppendResult:
+    """
+    Appends the events at the expected version. A conflict means the state the
+    events were decided on is stale, so it is dropped from the cache.
+    """
+    try:
+        return event_store.append_events(stream_name, events, expected_version)
+    except ExpectedVersionConflictError:
+        if cache is not None:
+            cache.invalidate(stream_name)
+        raise
+
+
+def read_stream(event_store: EventStore, stream_name: str) -> list[ShoppingCartEvent]:
+    return list(
+        decode_events(event_store.read_stream(stream_name), event_store.dictionaries)
+    )
+
+
+def iter_stream(
+    event_store: EventStore, stream_name: str
+) -> Iterator[ShoppingCartEvent]:
+    """
+    Lazily decodes the events of the stream while they are fetched.
+    """
+    return decode_events(event_store.iter_stream(stream_name), event_store.dictionaries)
+
+
+def get_shopping_cart(
+    event_store: EventStore,
+    stream_name: str,
+    cache: StateCache[ShoppingCart] | None = None,
+) -> tuple[ShoppingCart, int]:
+    """
+    Returns the shopping cart together with the stream version it was built from,
+    to be passed as the expected version when appending the next events.
+    With a cache, a cached cart is caught up with only the events appended
+    after its version, and the result is cached in turn.
+    """
+    cached = cache.get(stream_name) if cache is not None else None
+    state, stream_version = cached or (ShoppingCart(), 0)
+    events = event_store.read_stream(stream_name, from_version=stream_version)
+    if events:
+        stream_version = int(events[-1].stream_position)
+        for event in decode_events(events, event_store.dictionaries):
+            state = evolve(event, state)
+    if cache is not None:
+        cache.put(stream_name, state, stream_version)
+    return state, stream_version
+
+
+event_codec = EventCodec(
+    ShoppingCartOpened,
+    ProductItemAddedToShoppingCart,
+    ProductItemRemovedFromShoppingCart,
+    ShoppingCartConfirmed,
+    ShoppingCartCanceled,
+)
+
+
+def decode_events(
+    events: Iterable[EventStream | EventRow],
+    dictionaries: PayloadDictionaries | None = None,
+    batch_size: int = 500,
+) -> Iterator[ShoppingCartEvent]:
+    """
+    Lazily decodes stored events with the event codec, `batch_size` at a time.
+    Compressed payloads are decompressed with `dictionaries`.
+    """
+    for batch in batched(events, batch_size):
+        yield from event_codec.decode(
+            (
+                (
+                    str(event.event_type),
+                    event.payload_format,
+                    event.event_payload
+                    if event.event_payload is not None
+                    else str(event.event_data),
+                    event.dictionary_id,
+                )
+                for event in batch
+            ),
+            dictionaries,
+        )
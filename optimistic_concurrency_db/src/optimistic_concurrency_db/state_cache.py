@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+from pydantic import BaseModel, ConfigDict
+
+
+class StateCacheMetrics(BaseModel):
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+
+    model_config = ConfigDict(frozen=True)
+
+
+class StateCache[S]:
+    """
+    In-process cache of stream states, each with the stream version it was
+    folded to, so a load only has to read and apply the events appended since.
+    Holds up to `max_size` streams, evicting the least recently used one.
+    Safe to share between threads; states are expected to be immutable.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[S, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, stream_name: str) -> tuple[S, int] | None:
+        with self._lock:
+            entry = self._entries.get(stream_name)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(stream_name)
+            return entry
+
+    def put(self, stream_name: str, state: S, stream_version: int) -> None:
+        """
+        Caches the state, unless a state of a later version is cached already
+        by a concurrent load.
+        """
+        with self._lock:
+            entry = self._entries.get(stream_name)
+            if entry is not None and entry[1] > stream_version:
+                return
+            self._entries[stream_name] = (state, stream_version)
+            self._entries.move_to_end(stream_name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, stream_name: str) -> None:
+        with self._lock:
+            if self._entries.pop(stream_name, None) is not None:
+                self._invalidations += 1
+
+    @property
+    def metrics(self) -> StateCacheMetrics:
+        with self._lock:
+            return StateCacheMetrics(
+                size=len(self._entries),
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                invalidations=self._invalidations,
+            )
@@ -0,0 +1,54 @@
+import os
+import pytest
+from typing import Generator, cast
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from testcontainers.postgres import PostgresContainer  # type: ignore
+
+from optimistic_concurrency_db.src.optimistic_concurrency_db.event_store import (
+    EventStore,
+    create_sqlite_engine,
+)
+from optimistic_concurrency_db.src.optimistic_concurrency_db.model import Base
+
+
+@pytest.fixture(scope="session", autouse=True)
+def setup(
+    request: pytest.FixtureRequest, tmp_path_factory: pytest.TempPathFactory
+) -> str:
+    # DB_BACKEND=sqlite runs the tests in-process, without a container
+    if os.environ.get("DB_BACKEND") == "sqlite":
+        return f"sqlite:///{tmp_path_factory.mktemp('db') / 'events.db'}"
+
+    postgres = PostgresContainer("postgres:17-alpine")
+    postgres.start()
+
+    def remove_container() -> None:
+        postgres.stop()
+
+    request.addfinalizer(remove_container)
+    os.environ["DB_CONN"] = postgres.get_connection_url()
+    os.environ["DB_HOST"] = postgres.get_container_host_ip()
+    os.environ["DB_PORT"] = postgres.get_exposed_port(5432)
+    os.environ["DB_USERNAME"] = postgres.username
+    os.environ["DB_PASSWORD"] = postgres.password
+    os.environ["DB_NAME"] = postgres.dbname
+    return cast(str, postgres.get_connection_url())
+
+
+@pytest.fixture(scope="session")
+def db_session(setup: str) -> Generator[Session, None, None]:
+    engine = (
+        create_sqlite_engine(setup)
+        if setup.startswith("sqlite")
+        else create_engine(setup)
+    )
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture(scope="session")
+def event_store(db_session: Session) -> EventStore:
+    return EventStore(db_session)
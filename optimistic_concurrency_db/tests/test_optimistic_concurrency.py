@@ -0,0 +1,186 @@
+from decimal import Decimal
+from uuid import uuid4 as uuid
+from datetime import datetime, UTC
+import pytest
+
+
+from optimistic_concurrency_db.src.optimistic_concurrency_db import (
+    PricedProductItem,
+    ProductItemAddedToShoppingCart,
+    ShoppingCart,
+    ShoppingCartConfirmed,
+    ShoppingCartOpened,
+    append_to_stream,
+    get_shopping_cart,
+)
+from optimistic_concurrency_db.src.optimistic_concurrency_db.event_store import (
+    EventStore,
+    ExpectedVersionConflictError,
+    StreamState,
+)
+from optimistic_concurrency_db.src.optimistic_concurrency_db.state_cache import (
+    StateCache,
+)
+
+
+def open_shopping_cart(event_store: EventStore) -> tuple[str, str]:
+    shopping_cart_id = str(uuid())
+    stream_name = f"shopping_cart_{shopping_cart_id}"
+    append_to_stream(
+        event_store,
+        stream_name,
+        [
+            ShoppingCartOpened(
+                data=ShoppingCartOpened.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    client_id=str(uuid()),
+                    opened_at=datetime.now(UTC),
+                )
+            )
+        ],
+        expected_version=StreamState.NoStream,
+    )
+    return shopping_cart_id, stream_name
+
+
+def test_should_append_events_at_expected_version(event_store: EventStore) -> None:
+    """
+    Test that appending with the version the state was built from succeeds.
+    """
+    shopping_cart_id, stream_name = open_shopping_cart(event_store)
+    pair_of_shoes = PricedProductItem(
+        product_id=str(uuid()), quantity=1, unit_price=Decimal("100.0")
+    )
+
+    shopping_cart, stream_version = get_shopping_cart(event_store, stream_name)
+    assert shopping_cart.id == shopping_cart_id
+    assert stream_version == 1
+
+    result = append_to_stream(
+        event_store,
+        stream_name,
+        [
+            ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id, product_item=pair_of_shoes
+                )
+            )
+        ],
+        expected_version=stream_version,
+    )
+
+    assert result.next_expected_stream_version == 2
+    shopping_cart, stream_version = get_shopping_cart(event_store, stream_name)
+    assert shopping_cart.product_items == [pair_of_shoes]
+    assert stream_version == 2
+
+
+def test_should_reject_append_when_stream_moved(event_store: EventStore) -> None:
+    """
+    Test that the second of two writers holding the same version gets a conflict.
+    """
+    shopping_cart_id, stream_name = open_shopping_cart(event_store)
+    _, first_writer_version = get_shopping_cart(event_store, stream_name)
+    _, second_writer_version = get_shopping_cart(event_store, stream_name)
+
+    append_to_stream(
+        event_store,
+        stream_name,
+        [
+            ProductItemAddedToShoppingCart(
+                data=ProductItemAddedToShoppingCart.Data(
+                    shopping_cart_id=shopping_cart_id,
+                    product_item=PricedProductItem(
+                        product_id=str(uuid()), quantity=1, unit_price=Decimal("5.0")
+                    ),
+                )
+            )
+        ],
+        expected_version=first_writer_version,
+    )
+
+    with pytest.raises(ExpectedVersionConflictError) as conflict:
+        append_to_stream(
+            event_store,
+            stream_name,
+            [
+                ShoppingCartConfirmed(
+                    data=ShoppingCartConfirmed.Data(
+                        shopping_cart_id=shopping_cart_id,
+                        confirmed_at=datetime.now(UTC),
+                    )
+                )
+            ],
+            expected_version=second_writer_version,
+        )
+
+    assert conflict.value.actual_version == 2
+    assert event_store.stream_version(stream_name) == 2
+
+
+def test_should_check_stream_existence(event_store: EventStore) -> None:
+    """
+    Test that NoStream and StreamExists expectations are enforced.
+    """
+    shopping_cart_id, stream_name = open_shopping_cart(event_store)
+    confirmed = ShoppingCartConfirmed(
+        data=ShoppingCartConfirmed.Data(
+            shopping_cart_id=shopping_cart_id, confirmed_at=datetime.now(UTC)
+        )
+    )
+
+    with pytest.raises(ExpectedVersionConflictError):
+        append_to_stream(
+            event_store, stream_name, [confirmed], expected_version=StreamState.NoStream
+        )
+    with pytest.raises(ExpectedVersionConflictError):
+        append_to_stream(
+            event_store,
+            f"shopping_cart_{uuid()}",
+            [confirmed],
+            expected_version=StreamState.StreamExists,
+        )
+
+    result = append_to_stream(
+        event_store, stream_name, [confirmed], expected_version=StreamState.StreamExists
+    )
+    assert result.next_expected_stream_version == 2
+
+
+def test_should_catch_cached_carts_up_with_their_tail(event_store: EventStore) -> None:
+    """
+    Test that cached carts are caught up, evicted and invalidated on conflict.
+    """
+    cache = StateCache[ShoppingCart](max_size=1)
+    shopping_cart_id, stream_name = open_shopping_cart(event_store)
+    pair_of_shoes = PricedProductItem(
+        product_id=str(uuid()), quantity=1, unit_price=Decimal("100.0")
+    )
+    added = ProductItemAddedToShoppingCart(
+        data=ProductItemAddedToShoppingCart.Data(
+            shopping_cart_id=shopping_cart_id, product_item=pair_of_shoes
+        )
+    )
+
+    _, stream_version = get_shopping_cart(event_store, stream_name, cache)
+    # Appended without the cache, as another process would
+    append_to_stream(event_store, stream_name, [added], expected_version=1)
+    shopping_cart, stream_version = get_shopping_cart(event_store, stream_name, cache)
+    assert (shopping_cart, stream_version) == get_shopping_cart(
+        event_store, stream_name
+    )
+    assert shopping_cart.product_items == [pair_of_shoes]
+    assert cache.metrics.hits == 1 and cache.metrics.misses == 1
+
+    _, other_stream_name = open_shopping_cart(event_store)
+    get_shopping_cart(event_store, other_stream_name, cache)
+    assert cache.get(stream_name) is None
+    assert cache.metrics.evictions == 1
+
+    get_shopping_cart(event_store, other_stream_name, cache)
+    with pytest.raises(ExpectedVersionConflictError):
+        append_to_stream(
+            event_store, other_stream_name, [added], expected_version=0, cache=cache
+        )
+    assert cache.metrics.invalidations == 1
+    assert cache.metrics.size == 0
@@ -1,5 +1,6 @@
 from typing import Generic, TypeVar, Callable, Protocol, cast
 from collections import defaultdict
+from enum import StrEnum
 from uuid import uuid4
 from pydantic import BaseModel
 from projections_single_stream.src.projections_single_stream.model import Event
@@ -30,13 +31,36 @@ class EventWithTypeAndData(Protocol):
 T = TypeVar("T", bound=EventWithTypeAndData)
 
 
+class ReadDirection(StrEnum):
+    Forward = "forward"
+    Backward = "backward"
+
+
 class EventStore(Generic[T]):
     def __init__(self) -> None:
         self.streams: dict[str, list[T]] = defaultdict(list)
         self.handlers: list[EventHandler] = []
 
-    def read_stream(self, stream_name: str) -> list[T]:
-        return self.streams[stream_name]
+    def read_stream(
+        self,
+        stream_name: str,
+        from_version: int | None = None,
+        max_count: int | None = None,
+        direction: ReadDirection = ReadDirection.Forward,
+    ) -> list[T]:
+        """
+        Forward, returns up to `max_count` events after `from_version`, oldest
+        first. Backward, up to `max_count` events up to `from_version` or the
+        head of the stream, newest first.
+        """
+        events = self.streams.get(stream_name, [])
+        if direction == ReadDirection.Forward:
+            start = from_version or 0
+            return events[start : None if max_count is None else start + max_count]
+        end = len(events) if from_version is None else min(from_version, len(events))
+        window = events[0 if max_count is None else max(end - max_count, 0) : end]
+        window.reverse()
+        return window
 
     def append_events(self, stream_name: str, events: list[T]) -> None:
         current_stream = self.streams.get(stream_name, [])